@@ -1,16 +1,23 @@
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+import matplotlib
 import matplotlib.dates as mdates
-import json
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
+import argparse
+import hashlib
+import json
 import os
+import time
 
-def get_fishing_vessel_ids(data):
-    # Convert nodes data to DataFrame
-    nodes_df = pd.DataFrame(data['nodes'])
-    
+from mc2_loader import FISHING_VESSEL
+from ping_store import load_ping_index, load_vessels
+
+def get_fishing_vessel_ids(nodes_df):
     # Filter fishing vessels
-    fishing_vessels = nodes_df[nodes_df['type'] == 'Entity.Vessel.FishingVessel']
+    fishing_vessels = nodes_df[nodes_df['type'] == FISHING_VESSEL]
     
     # Get unique vessel IDs
     vessel_ids = sorted(fishing_vessels['id'].unique())
@@ -21,189 +28,391 @@ def get_fishing_vessel_ids(data):
     
     return vessel_ids
 
+# Define colors for specific locations
+SPECIAL_LOCATION_COLORS = {
+    'Nemo Reef': '#FFA500',  # Orange
+    'Ghoti Preserve': '#FFA500',  # Orange
+    'Don Limpet Preserve': '#FFA500'  # Orange
+}
+DEFAULT_LOCATION_COLOR = 'steelblue'
+
+# Red reference line and output resolution of the per-vessel plots
+REFERENCE_DATE = '2035-05-14'
+PLOT_DPI = 300
+
+# Summary overview: vessels per page and heatmap time bin
+SUMMARY_PAGE_SIZE = 20
+SUMMARY_BIN_DAYS = 7
+
+# Stores a content hash per rendered plot so unchanged vessels are skipped
+MANIFEST_FILE = 'dwell_manifest.json'
+
 def get_location_color(location):
-    # Define colors for specific locations
-    special_locations = {
-        'Nemo Reef': '#FFA500',  # Orange
-        'Ghoti Preserve': '#FFA500',  # Orange
-        'Don Limpet Preserve': '#FFA500'  # Orange
-    }
-    return special_locations.get(location, 'steelblue')
+    return SPECIAL_LOCATION_COLORS.get(location, DEFAULT_LOCATION_COLOR)
 
-def analyze_vessel_dwell_time(data, target_vessel, output_dir):
-    # Convert edge data to DataFrame
-    edges_df = pd.DataFrame(data['links'])
+def draw_dwell_timeline(ax, vessel_data):
+    # Draw every ping with dwell time as a vertical line on its location's row.
+    # All lines go into a single collection instead of one artist per ping.
+    # Returns the sorted locations, one per row.
+    locations = sorted(vessel_data['location_id'].unique())
     
-    # Filter TransponderPing type edges
-    pings_df = edges_df[edges_df['type'] == 'Event.TransportEvent.TransponderPing'].copy()
+    # Only draw records with dwell time
+    dwell = pd.to_numeric(vessel_data['dwell'], errors='coerce').to_numpy(dtype=float)
+    shown = dwell > 0
     
-    # Filter target vessel data
-    vessel_data = pings_df[pings_df['target'] == target_vessel].copy()
+    # Row index and color of every ping, looked up once per location
+    rows = pd.Categorical(vessel_data['location_id'], categories=locations).codes[shown]
+    row_colors = np.array([get_location_color(location) for location in locations], dtype=object)
+    times = pd.to_datetime(vessel_data['time']).to_numpy()[shown]
     
-    # If no data found for this vessel, skip
-    if len(vessel_data) == 0:
-        print(f"No transponder data found for vessel {target_vessel}")
-        return
-    
-    # Convert time strings to datetime objects
-    vessel_data['datetime'] = pd.to_datetime(vessel_data['time'], format='ISO8601')
+    ax.vlines(x=times, ymin=rows-0.3, ymax=rows+0.3,
+              colors=list(row_colors[rows]), alpha=0.6, linewidth=2)
+    return locations
+
+def render_vessel_dwell_plot(vessel_data, target_vessel, output_dir):
+    # Object-oriented Matplotlib on an Agg canvas: no pyplot global state,
+    # so this can run in worker processes
     
     # Create figure
-    plt.figure(figsize=(15, 8))
-    plt.gca().set_facecolor('#f8f8f8')
-    
-    # Get all unique locations
-    locations = sorted(vessel_data['source'].unique())
+    fig = Figure(figsize=(15, 8))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.set_facecolor('#f8f8f8')
     
     # Create timeline for each location
-    for idx, location in enumerate(locations):
-        # Get data for this location
-        location_data = vessel_data[vessel_data['source'] == location]
-        
-        # Draw dwell time lines
-        for _, row in location_data.iterrows():
-            dwell_time = float(row['dwell'])  # Ensure dwell is numeric
-            if dwell_time > 0:  # Only draw records with dwell time
-                # Draw vertical lines to represent dwell time
-                plt.vlines(x=row['datetime'], ymin=idx-0.3, ymax=idx+0.3,
-                         color=get_location_color(location), alpha=0.6, linewidth=2)
+    locations = draw_dwell_timeline(ax, vessel_data)
     
     # Add red vertical line for May 14, 2035
-    target_date = pd.to_datetime('2035-05-14')
-    plt.axvline(x=target_date, color='red', alpha=0.8, linewidth=3)
+    target_date = pd.to_datetime(REFERENCE_DATE)
+    ax.axvline(x=target_date, color='red', alpha=0.8, linewidth=3)
     
     # Set y-axis ticks and labels
-    plt.yticks(range(len(locations)), locations)
+    ax.set_yticks(range(len(locations)), locations)
     
     # Set x-axis format
-    plt.gca().xaxis.set_major_locator(mdates.MonthLocator())
-    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
-    plt.xticks(rotation=45)
+    ax.xaxis.set_major_locator(mdates.MonthLocator())
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
+    ax.tick_params(axis='x', labelrotation=45)
     
     # Set title and labels
-    plt.title(f'Vessel Dwell Time Distribution ({target_vessel})', pad=20, fontsize=14)
-    plt.xlabel('Time', fontsize=12)
-    plt.ylabel('Location', fontsize=12)
+    ax.set_title(f'Vessel Dwell Time Distribution ({target_vessel})', pad=20, fontsize=14)
+    ax.set_xlabel('Time', fontsize=12)
+    ax.set_ylabel('Location', fontsize=12)
     
     # Add grid lines
-    plt.grid(True, axis='x', linestyle='--', alpha=0.2)
-    plt.margins(x=0.01)
+    ax.grid(True, axis='x', linestyle='--', alpha=0.2)
+    ax.margins(x=0.01)
     
     # Add horizontal separators
     for y in range(len(locations)-1):
-        plt.axhline(y=y+0.5, color='gray', linestyle='-', alpha=0.1)
+        ax.axhline(y=y+0.5, color='gray', linestyle='-', alpha=0.1)
     
     # Remove top and right borders
-    plt.gca().spines['top'].set_visible(False)
-    plt.gca().spines['right'].set_visible(False)
-    plt.gca().spines['left'].set_alpha(0.2)
-    plt.gca().spines['bottom'].set_alpha(0.2)
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.spines['left'].set_alpha(0.2)
+    ax.spines['bottom'].set_alpha(0.2)
     
-    plt.tight_layout()
+    fig.tight_layout()
     
     # Save the plot
-    plt.savefig(os.path.join(output_dir, f'vessel_{target_vessel}_dwell_time.png'),
+    output_file = os.path.join(output_dir, dwell_plot_filename(target_vessel))
+    fig.savefig(output_file,
                 bbox_inches='tight',
-                dpi=300,
+                dpi=PLOT_DPI,
                 facecolor='#f8f8f8')
-    print(f"Generated dwell time plot for vessel {target_vessel}")
-    plt.close()
+    return output_file
+
+def dwell_plot_filename(vessel_id):
+    return f'vessel_{vessel_id}_dwell_time.png'
 
-def create_summary_plot(data, vessel_ids, output_dir):
-    # Convert edge data to DataFrame
-    edges_df = pd.DataFrame(data['links'])
+def window_dir_name(start=None, end=None):
+    # Plots of a [start, end) window get their own subdirectory (and manifest),
+    # so they never replace the full-history plots
+    def label(value, open_end):
+        if value is None:
+            return open_end
+        stamp = pd.Timestamp(value)
+        return stamp.strftime('%Y-%m-%d' if stamp == stamp.normalize() else '%Y-%m-%dT%H%M%S')
+    return f'window_{label(start, "begin")}_{label(end, "end")}'
+
+def analyze_vessel_dwell_time(ping_index, target_vessel, output_dir):
+    # Take the vessel's time-sorted pings from the per-vessel index
+    vessel_data = ping_index.vessel(target_vessel)
     
-    # Filter TransponderPing type edges
-    pings_df = edges_df[edges_df['type'] == 'Event.TransportEvent.TransponderPing'].copy()
+    # If no data found for this vessel, skip
+    if len(vessel_data) == 0:
+        print(f"No transponder data found for vessel {target_vessel}")
+        return
     
-    # Create figure
-    plt.figure(figsize=(20, 15))
-    plt.gca().set_facecolor('#f8f8f8')
+    render_vessel_dwell_plot(vessel_data, target_vessel, output_dir)
+    print(f"Generated dwell time plot for vessel {target_vessel}")
+
+def plot_params_key():
+    # Everything besides the pings that changes how a plot looks
+    return json.dumps({
+        'reference_date': REFERENCE_DATE,
+        'special_location_colors': SPECIAL_LOCATION_COLORS,
+        'default_location_color': DEFAULT_LOCATION_COLOR,
+        'dpi': PLOT_DPI
+    }, sort_keys=True)
+
+def vessel_plot_hash(vessel_data):
+    # Hash of the vessel's ping slice plus the plot parameters
+    digest = hashlib.sha256(plot_params_key().encode('utf-8'))
+    rows = pd.util.hash_pandas_object(vessel_data[['location_id', 'time', 'dwell']], index=False)
+    digest.update(rows.to_numpy().tobytes())
+    return digest.hexdigest()
+
+def load_manifest(output_dir):
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(output_dir, manifest):
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def _init_render_worker():
+    matplotlib.use('Agg')
+
+def _render_task(task):
+    vessel_id, vessel_data, output_dir = task
+    start_time = time.time()
+    render_vessel_dwell_plot(vessel_data, vessel_id, output_dir)
+    return vessel_id, time.time() - start_time
+
+def render_dwell_plots(ping_index, vessel_ids, output_dir, workers=1, force=False):
+    # Fan the per-vessel plots out over a process pool (workers=1 renders serially).
+    # Vessels whose pings and plot parameters match the manifest are skipped
+    # unless force is set.
+    start_time = time.time()
+    manifest = load_manifest(output_dir)
+    hashes = {}
+    tasks = []
+    skipped = 0
+    for vessel_id in vessel_ids:
+        vessel_data = ping_index.vessel(vessel_id)
+        if len(vessel_data) == 0:
+            print(f"No transponder data found for vessel {vessel_id}")
+            continue
+        hashes[vessel_id] = vessel_plot_hash(vessel_data)
+        output_file = os.path.join(output_dir, dwell_plot_filename(vessel_id))
+        if not force and manifest.get(vessel_id) == hashes[vessel_id] and os.path.exists(output_file):
+            skipped += 1
+            continue
+        tasks.append((vessel_id, vessel_data, output_dir))
+    if skipped:
+        print(f"Skipping {skipped} unchanged vessel plots")
+    
+    render_times = {}
+    if workers <= 1:
+        results = map(_render_task, tasks)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker)
+        futures = [executor.submit(_render_task, task) for task in tasks]
+        results = (future.result() for future in as_completed(futures))
+    try:
+        for done, (vessel_id, seconds) in enumerate(results, 1):
+            render_times[vessel_id] = seconds
+            manifest[vessel_id] = hashes[vessel_id]
+            print(f"[{done}/{len(tasks)}] Generated dwell time plot for vessel {vessel_id} ({seconds:.2f}s)")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        # Record finished plots even if a later one failed
+        save_manifest(output_dir, manifest)
     
-    # Calculate grid dimensions
-    n_vessels = len(vessel_ids)
+    elapsed = time.time() - start_time
+    if render_times:
+        slowest = max(render_times, key=render_times.get)
+        print(f"\nRendered {len(render_times)} plots with {max(workers, 1)} worker(s) in {elapsed:.2f}s "
+              f"(total render time {sum(render_times.values()):.2f}s, "
+              f"slowest {slowest} {render_times[slowest]:.2f}s)")
+    return render_times
+
+def create_summary_plot(ping_index, vessel_ids, output_dir, per_page=SUMMARY_PAGE_SIZE):
+    # Paged summary: each page holds at most per_page vessels in a 2-column grid,
+    # so memory and render time per figure stay bounded for any fleet size
     n_cols = 2  # 2 columns
-    n_rows = (n_vessels + 1) // 2  # Round up division
+    n_pages = max((len(vessel_ids) + per_page - 1) // per_page, 1)
+    output_files = []
     
-    # Create subplots
-    for idx, vessel_id in enumerate(vessel_ids, 1):
-        plt.subplot(n_rows, n_cols, idx)
-        
-        # Filter vessel data
-        vessel_data = pings_df[pings_df['target'] == vessel_id].copy()
-        if len(vessel_data) == 0:
-            continue
+    for page in range(n_pages):
+        page_vessels = vessel_ids[page * per_page:(page + 1) * per_page]
+        n_rows = max((len(page_vessels) + 1) // 2, 1)  # Round up division
         
-        # Convert time strings to datetime objects
-        vessel_data['datetime'] = pd.to_datetime(vessel_data['time'], format='ISO8601')
+        # Create figure
+        fig = Figure(figsize=(20, max(4, 3 * n_rows)))
+        FigureCanvasAgg(fig)
         
-        # Get all unique locations
-        locations = sorted(vessel_data['source'].unique())
+        # Create subplots
+        for idx, vessel_id in enumerate(page_vessels, 1):
+            ax = fig.add_subplot(n_rows, n_cols, idx)
+            ax.set_facecolor('#f8f8f8')
+            
+            # Take vessel data from the per-vessel index
+            vessel_data = ping_index.vessel(vessel_id)
+            if len(vessel_data) == 0:
+                continue
+            
+            # Create timeline for each location
+            locations = draw_dwell_timeline(ax, vessel_data)
+            
+            # Add May 12, 2035 line
+            target_date = pd.to_datetime('2035-05-12')
+            ax.axvline(x=target_date, color='red', alpha=0.8, linewidth=3)
+            
+            # Customize subplot
+            ax.set_yticks(range(len(locations)), locations, fontsize=8)
+            ax.tick_params(axis='x', labelrotation=45, labelsize=8)
+            ax.set_title(f'Vessel {vessel_id}', pad=10, fontsize=10)
+            
+            # Add grid
+            ax.grid(True, axis='x', linestyle='--', alpha=0.2)
+            
+            # Remove borders
+            ax.spines['top'].set_visible(False)
+            ax.spines['right'].set_visible(False)
+            ax.spines['left'].set_alpha(0.2)
+            ax.spines['bottom'].set_alpha(0.2)
         
-        # Create timeline for each location
-        for loc_idx, location in enumerate(locations):
-            location_data = vessel_data[vessel_data['source'] == location]
-            for _, row in location_data.iterrows():
-                dwell_time = float(row['dwell'])
-                if dwell_time > 0:
-                    plt.vlines(x=row['datetime'], ymin=loc_idx-0.3, ymax=loc_idx+0.3,
-                             color=get_location_color(location), alpha=0.6, linewidth=2)
+        fig.suptitle(f'Summary of All Vessels Dwell Time Distribution (page {page + 1}/{n_pages})',
+                     fontsize=16)
+        fig.tight_layout()
         
-        # Add May 12, 2035 line
-        target_date = pd.to_datetime('2035-05-12')
-        plt.axvline(x=target_date, color='red', alpha=0.8, linewidth=3)
-        
-        # Customize subplot
-        plt.yticks(range(len(locations)), locations, fontsize=8)
-        plt.xticks(rotation=45, fontsize=8)
-        plt.title(f'Vessel {vessel_id}', pad=10, fontsize=10)
-        
-        # Add grid
-        plt.grid(True, axis='x', linestyle='--', alpha=0.2)
-        
-        # Remove borders
-        plt.gca().spines['top'].set_visible(False)
-        plt.gca().spines['right'].set_visible(False)
-        plt.gca().spines['left'].set_alpha(0.2)
-        plt.gca().spines['bottom'].set_alpha(0.2)
+        # Save summary page
+        output_file = os.path.join(output_dir, f'all_vessels_summary_p{page + 1:03d}.png')
+        fig.savefig(output_file,
+                    bbox_inches='tight',
+                    dpi=PLOT_DPI,
+                    facecolor='#f8f8f8')
+        output_files.append(output_file)
     
-    plt.suptitle('Summary of All Vessels Dwell Time Distribution', fontsize=16, y=0.95)
-    plt.tight_layout()
+    print(f"\nGenerated {n_pages} summary page(s) for {len(vessel_ids)} vessels")
+    return output_files
+
+def aggregate_dwell(ping_index, vessel_ids, bin_days=SUMMARY_BIN_DAYS):
+    # Pre-aggregate dwell into a (vessel, location, time bin) array in one pass
+    pings = ping_index.pings
+    pings = pings[pings['vessel_id'].isin(vessel_ids) & (pings['time'] != np.iinfo(np.int64).min)]
+    locations = sorted(pings['location_id'].unique())
+    if len(pings) == 0:
+        return np.zeros((len(vessel_ids), 0, 0)), locations, np.array([], dtype='datetime64[ns]')
     
-    # Save summary plot
-    plt.savefig(os.path.join(output_dir, 'all_vessels_summary.png'),
-                bbox_inches='tight',
-                dpi=300,
-                facecolor='#f8f8f8')
-    print("\nGenerated summary plot for all vessels")
-    plt.close()
+    bin_ns = int(bin_days * 86400 * 10**9)
+    times = pings['time'].to_numpy()
+    first_bin = times.min() // bin_ns * bin_ns
+    n_bins = int((times.max() - first_bin) // bin_ns) + 1
+    
+    vessel_codes = pd.Categorical(pings['vessel_id'], categories=list(vessel_ids)).codes.astype(np.int64)
+    location_codes = pd.Categorical(pings['location_id'], categories=locations).codes.astype(np.int64)
+    bins = (times - first_bin) // bin_ns
+    dwell = np.nan_to_num(pings['dwell'].to_numpy(dtype=float))
+    
+    shape = (len(vessel_ids), len(locations), n_bins)
+    flat_index = (vessel_codes * shape[1] + location_codes) * shape[2] + bins
+    dwell_array = np.bincount(flat_index, weights=dwell, minlength=np.prod(shape)).reshape(shape)
+    bin_starts = (first_bin + np.arange(n_bins) * bin_ns).astype('datetime64[ns]')
+    return dwell_array, locations, bin_starts
+
+def create_summary_heatmap(ping_index, vessel_ids, output_dir, bin_days=SUMMARY_BIN_DAYS):
+    # Dense fleet overview: one row per vessel, one column per time bin.
+    # Left panel is total dwell, right panel dwell in the special locations.
+    dwell_array, locations, bin_starts = aggregate_dwell(ping_index, vessel_ids, bin_days)
+    if len(bin_starts) == 0:
+        print("\nNo pings to summarize, skipping the dwell heatmap")
+        return None
+    special = [idx for idx, location in enumerate(locations) if location in SPECIAL_LOCATION_COLORS]
+    panels = [('All locations', dwell_array.sum(axis=1)),
+              ('Nemo Reef / Ghoti Preserve / Don Limpet Preserve', dwell_array[:, special, :].sum(axis=1))]
+    
+    fig = Figure(figsize=(20, min(max(4, 0.12 * len(vessel_ids)), 60)))
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(1, 2, sharey=True)
+    extent = [mdates.date2num(bin_starts[0]),
+              mdates.date2num(bin_starts[-1] + np.timedelta64(int(bin_days * 86400), 's')),
+              len(vessel_ids) - 0.5, -0.5]
+    for ax, (title, values) in zip(axes, panels):
+        image = ax.imshow(np.log1p(values), aspect='auto', interpolation='nearest',
+                          cmap='viridis', extent=extent)
+        ax.axvline(x=pd.to_datetime(REFERENCE_DATE), color='red', alpha=0.8, linewidth=2)
+        ax.xaxis_date()
+        ax.xaxis.set_major_locator(mdates.MonthLocator())
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
+        ax.tick_params(axis='x', labelrotation=45)
+        ax.set_title(title, fontsize=12)
+        ax.set_xlabel('Time', fontsize=12)
+        fig.colorbar(image, ax=ax, label='log(1 + dwell)')
+    
+    # Vessel labels only while they remain readable
+    if len(vessel_ids) <= 150:
+        axes[0].set_yticks(range(len(vessel_ids)), vessel_ids, fontsize=6)
+    axes[0].set_ylabel('Vessel', fontsize=12)
+    fig.suptitle(f'Fleet Dwell Time Overview ({len(vessel_ids)} vessels, {bin_days}-day bins)', fontsize=16)
+    fig.tight_layout()
+    
+    output_file = os.path.join(output_dir, 'all_vessels_heatmap.png')
+    fig.savefig(output_file, bbox_inches='tight', dpi=PLOT_DPI, facecolor='#f8f8f8')
+    print(f"\nGenerated dwell heatmap for {len(vessel_ids)} vessels")
+    return output_file
 
-def analyze_all_fishing_vessels(file_path):
-    # Read JSON file
+def analyze_all_fishing_vessels(file_path, workers=1, force=False, summary=None, vessel_ids=None,
+                                start=None, end=None):
+    # Read the columnar ping store (built from the JSON file on first use)
     print("Reading data...")
-    with open(file_path, 'r') as f:
-        data = json.load(f)
+    nodes_df = load_vessels(file_path, vessel_type=FISHING_VESSEL)
+    if vessel_ids is not None:
+        nodes_df = nodes_df[nodes_df['id'].isin(vessel_ids)]
+    # Group pings by vessel once instead of rescanning them for every plot;
+    # only the selected vessels and the [start, end) window are read
+    ping_index = load_ping_index(file_path, vessel_ids=nodes_df['id'], start=start, end=end)
     
     # Get all fishing vessel IDs
-    vessel_ids = get_fishing_vessel_ids(data)
+    vessel_ids = get_fishing_vessel_ids(nodes_df)
     
-    # Create output directory
+    # Create output directory (a subdirectory for windowed plots)
     output_dir = 'fishing_vessel_plots'
+    if start is not None or end is not None:
+        output_dir = os.path.join(output_dir, window_dir_name(start, end))
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
         print(f"\nCreated output directory: {output_dir}")
     
     # Generate individual plots for each vessel
     print("\nGenerating dwell time plots for each vessel...")
-    for vessel_id in vessel_ids:
-        analyze_vessel_dwell_time(data, vessel_id, output_dir)
+    render_dwell_plots(ping_index, vessel_ids, output_dir, workers=workers, force=force)
     
-    # Generate summary plot
-    # create_summary_plot(data, vessel_ids, output_dir)
+    # Generate summary overview
+    if summary == 'pages':
+        create_summary_plot(ping_index, vessel_ids, output_dir)
+    elif summary == 'heatmap':
+        create_summary_heatmap(ping_index, vessel_ids, output_dir)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate dwell time plots for all fishing vessels')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='number of processes rendering plots in parallel (1 = serial)')
+    parser.add_argument('--force', action='store_true',
+                        help='re-render every plot even if its pings have not changed')
+    parser.add_argument('--summary', choices=['pages', 'heatmap'],
+                        help='also render a fleet overview: paged per-vessel timelines or a dwell heatmap')
+    parser.add_argument('--vessels', nargs='+', metavar='VESSEL_ID',
+                        help='only plot these fishing vessels')
+    parser.add_argument('--start', metavar='DATE',
+                        help='only plot pings at or after this time (into a window_<start>_<end> subdirectory)')
+    parser.add_argument('--end', metavar='DATE',
+                        help='only plot pings before this time (into a window_<start>_<end> subdirectory)')
+    args = parser.parse_args()
     try:
-        analyze_all_fishing_vessels("MC2/mc2.json")
+        analyze_all_fishing_vessels("MC2/mc2.json", workers=args.workers, force=args.force,
+                                    summary=args.summary, vessel_ids=args.vessels,
+                                    start=args.start, end=args.end)
         print("\nAll plots have been generated successfully")
     except FileNotFoundError:
         print("Error: Could not find data file 'MC2/mc2.json'")
@@ -0,0 +1,702 @@
+"""
+Micro-benchmarks for the performance-sensitive stages of the analysis scripts.
+
+Run one benchmark by name, e.g.
+
+    python benchmarks.py dwell_render
+
+`python benchmarks.py parse_pings` is also a quick check that sunburst.py's
+vectorized ping parsing matches the old per-row loop; add --pings 1000000
+for the full-size timing.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+
+def timed(func, *args, repeat=1, **kwargs):
+    """Best wall time of `repeat` calls, and the last result"""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start_time)
+    return best, result
+
+
+def synthetic_vessel_pings(n_pings, seed=0):
+    """Time-sorted pings of one vessel, in the layout of ping_store's ping table"""
+    rng = np.random.default_rng(seed)
+    locations = ['City of Haacklee', 'City of Lomark', 'Cod Table', 'Wrasse Beds', 'Tuna Shelf',
+                 'Nemo Reef', 'Ghoti Preserve', 'Don Limpet Preserve', 'Nav 1', 'Nav 2', 'Exit East']
+    start = pd.Timestamp('2035-02-01').value
+    times = np.sort(start + rng.integers(0, 300 * 86400 * 10**9, n_pings))
+    return pd.DataFrame({
+        'vessel_id': pd.Categorical(['synthetic'] * n_pings),
+        'location_id': pd.Categorical(rng.choice(locations, n_pings)),
+        'time': times,
+        'dwell': np.where(rng.random(n_pings) < 0.1, 0, rng.random(n_pings) * 50000),
+    })
+
+
+# ── dwell_render ─────────────────────────────────────────────────────────────
+
+def _draw_dwell_timeline_per_row(ax, vessel_data):
+    # Previous implementation: one vlines call per ping
+    from analyze_all_vessels_dwell import get_location_color
+    vessel_data = vessel_data.copy()
+    vessel_data['datetime'] = pd.to_datetime(vessel_data['time'])
+    locations = sorted(vessel_data['location_id'].unique())
+    for idx, location in enumerate(locations):
+        location_data = vessel_data[vessel_data['location_id'] == location]
+        for _, row in location_data.iterrows():
+            if float(row['dwell']) > 0:
+                ax.vlines(x=row['datetime'], ymin=idx-0.3, ymax=idx+0.3,
+                          color=get_location_color(location), alpha=0.6, linewidth=2)
+    return locations
+
+
+def bench_dwell_render(n_pings=50000, dpi=100):
+    """Per-vessel dwell plot: one vlines call per ping vs one batched collection"""
+    import io
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    import analyze_all_vessels_dwell as dwell
+
+    vessel_data = synthetic_vessel_pings(n_pings)
+
+    def render(draw):
+        fig = Figure(figsize=(15, 8))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        draw(ax, vessel_data)
+        fig.savefig(io.BytesIO(), format='png', dpi=dpi)
+        return len(ax.collections)
+
+    before, before_artists = timed(render, _draw_dwell_timeline_per_row)
+    after, after_artists = timed(render, dwell.draw_dwell_timeline, repeat=3)
+    print(f"dwell_render: {n_pings:,} pings, dpi={dpi}")
+    print(f"  per-ping vlines : {before:8.2f}s  ({before_artists:,} collections)")
+    print(f"  batched vlines  : {after:8.2f}s  ({after_artists:,} collections)")
+    print(f"  speed-up        : {before / after:8.1f}x")
+
+
+# ── split_cycles ─────────────────────────────────────────────────────────────
+
+PORTS = ['City of Haacklee', 'City of Lomark', 'City of Himark', 'City of Paackland']
+SEA = ['Cod Table', 'Wrasse Beds', 'Tuna Shelf', 'Nemo Reef', 'Ghoti Preserve',
+       'Don Limpet Preserve', 'Nav 1', 'Nav 2', 'Exit East']
+
+
+def synthetic_fleet_pings(n_pings, n_vessels=200, port_share=0.15, seed=0):
+    """Unsorted pings of a whole fleet, in the layout of sunburst.py's `pings`"""
+    rng = np.random.default_rng(seed)
+    is_port = rng.random(n_pings) < port_share
+    locations = np.where(is_port, rng.choice(PORTS, n_pings), rng.choice(SEA, n_pings))
+    start = pd.Timestamp('2035-02-01').value
+    return pd.DataFrame({
+        'vessel_id': np.array([f'vessel{i}' for i in range(n_vessels)])[rng.integers(0, n_vessels, n_pings)],
+        'location_id': locations,
+        'time': pd.to_datetime(start + rng.integers(0, 300 * 86400 * 10**9, n_pings)),
+        'dwell': rng.random(n_pings) * 50000,
+    })
+
+
+def _split_cycles_per_row(pings, port_ids, min_pings):
+    # Previous implementation: iterrows state machine and one DataFrame per trip
+    def split(df):
+        cycles, buf, in_trip = [], [], False
+        for _, row in df.iterrows():
+            is_port = row.location_id in port_ids
+            if not in_trip and not is_port: buf=[row]; in_trip=True
+            elif in_trip and not is_port:  buf.append(row)
+            elif in_trip and is_port:
+                if len(buf) >= min_pings: cycles.append(pd.DataFrame(buf))
+                in_trip=False; buf=[]
+        return cycles
+
+    cycle_frames = []
+    for vid, grp in pings.groupby('vessel_id', sort=False):
+        for i, cyc in enumerate(split(grp.sort_values('time', kind='stable')), 1):
+            cyc['cycle_id'] = f"{vid}_{i}"; cycle_frames.append(cyc)
+    return pd.concat(cycle_frames, ignore_index=True)
+
+
+def bench_split_cycles(n_pings=100000, large=(1000000, 10000000), min_pings=3):
+    """sunburst.py cycle segmentation: iterrows state machine vs vectorized masks"""
+    from cycle_analysis import split_cycles
+
+    pings = synthetic_fleet_pings(n_pings)
+    before, expected = timed(_split_cycles_per_row, pings, set(PORTS), min_pings)
+    after, cycles = timed(split_cycles, pings, set(PORTS), min_pings, repeat=3)
+    pd.testing.assert_frame_equal(cycles, expected, check_dtype=False)
+    print(f"split_cycles: {n_pings:,} pings -> {cycles['cycle_id'].nunique():,} cycles (identical output)")
+    print(f"  iterrows   : {before:8.2f}s")
+    print(f"  vectorized : {after:8.2f}s  ({before / after:.0f}x)")
+    for size in large:
+        seconds, cycles = timed(split_cycles, synthetic_fleet_pings(size, n_vessels=5000), set(PORTS), min_pings)
+        print(f"  vectorized : {seconds:8.2f}s  for {size:,} pings ({cycles['cycle_id'].nunique():,} cycles)")
+
+
+# ── parse_pings ──────────────────────────────────────────────────────────────
+
+def synthetic_ping_edges(n_pings, n_vessels=200, seed=0):
+    """TransponderPing edges as sunburst.py builds them, with some reversed / invalid ones"""
+    rng = np.random.default_rng(seed)
+    vessels = np.array([f'vessel{i}' for i in range(n_vessels)])
+    vessel = vessels[rng.integers(0, n_vessels, n_pings)]
+    location = rng.choice(PORTS + SEA, n_pings)
+    flip = rng.random(n_pings) < 0.05
+    source, target = np.where(flip, vessel, location), np.where(flip, location, vessel)
+    # A few edges without a vessel endpoint or between two vessels
+    odd = rng.random(n_pings) < 0.01
+    target = np.where(odd, np.where(flip, vessel, location), target)
+    start = pd.Timestamp('2035-02-01').value
+    times = pd.to_datetime(start + rng.integers(0, 300 * 86400 * 10**9, n_pings))
+    time_text = times.strftime('%Y-%m-%dT%H:%M:%S.%f').to_numpy(dtype=object)
+    invalid = rng.random(n_pings) < 0.001
+    invalid[::1000] = True  # at least one, even for small checks
+    time_text[invalid] = 'not a time'
+    return pd.DataFrame({
+        'type': 'Event.TransportEvent.TransponderPing',
+        'source': source, 'target': target, 'time': time_text,
+        'dwell': rng.random(n_pings) * 50000,
+    }), set(vessels)
+
+
+def _parse_pings_per_row(ping_raw, vessel_ids):
+    # Previous implementation: parse_ping + pd.to_datetime per row
+    def parse_ping(r):
+        s, t = r['source'], r['target']
+        if s in vessel_ids and t not in vessel_ids:  return s, t
+        if t in vessel_ids and s not in vessel_ids:  return t, s
+        return None, None
+
+    records = []
+    for _, r in ping_raw.iterrows():
+        vid, lid = parse_ping(r)
+        if vid:
+            records.append([vid, lid,
+                            pd.to_datetime(r['time'], errors='coerce'),
+                            float(r.get('dwell', 0))])
+    return pd.DataFrame(records, columns=['vessel_id','location_id','time','dwell'])
+
+
+def bench_parse_pings(n_pings=2000):
+    """
+    sunburst.py step 3: iterrows + parse_ping vs isin / bulk to_datetime.
+    Doubles as the check that both give identical pings; the default size
+    keeps it to about a second (--pings 1000000 takes about 9 minutes,
+    nearly all of it in the per-row loop)
+    """
+    from cycle_analysis import parse_pings
+
+    edges, vessel_ids = synthetic_ping_edges(n_pings)
+    after, pings = timed(parse_pings, edges, vessel_ids, repeat=3)
+    before, expected = timed(_parse_pings_per_row, edges, vessel_ids)
+    pd.testing.assert_frame_equal(pings, expected, check_dtype=False)
+    print(f"parse_pings: {n_pings:,} edges -> {len(pings):,} pings (identical output)")
+    print(f"  iterrows   : {before:8.2f}s")
+    print(f"  vectorized : {after:8.2f}s  ({before / after:.0f}x)")
+
+
+# ── filter_features ──────────────────────────────────────────────────────────
+
+SEA_KINDS = {'Cod Table': 'fishing ground', 'Wrasse Beds': 'fishing ground', 'Tuna Shelf': 'fishing ground',
+             'Nemo Reef': 'ecological preserve', 'Ghoti Preserve': 'ecological preserve',
+             'Don Limpet Preserve': 'ecological preserve'}
+
+
+def synthetic_cycles(n_cycles, pings_per_cycle=6, n_vessels=5000, seed=0):
+    """Cycle rows as split_cycles returns them, plus the matching loc_meta"""
+    rng = np.random.default_rng(seed)
+    n_rows = n_cycles * pings_per_cycle
+    cycle = np.repeat(np.arange(n_cycles), pings_per_cycle)
+    vessel = np.array([f'vessel{i}' for i in range(n_vessels)])[np.arange(n_cycles) % n_vessels][cycle]
+    start = pd.Timestamp('2035-02-01').value
+    cycles = pd.DataFrame({
+        'vessel_id': vessel,
+        'location_id': rng.choice(SEA, n_rows),
+        'time': pd.to_datetime(start + rng.integers(0, 300 * 86400 * 10**9, n_rows)),
+        'dwell': rng.random(n_rows) * 50000,
+        'cycle_id': pd.Series(vessel) + '_' + pd.Series(cycle // n_vessels + 1, dtype=str),
+    })
+    loc_meta = pd.DataFrame({'id': SEA, 'kind': [SEA_KINDS.get(loc, 'buoy') for loc in SEA], 'Name': SEA})
+    return cycles, loc_meta
+
+
+def _filter_features_per_group(cycles_df, loc_meta, fg_ids, preserve_ids):
+    # Previous implementation: groupby.apply(lambda) per cycle / vessel and pivot_table
+    has_fg = cycles_df.groupby('cycle_id')['location_id'].apply(lambda col: col.isin(fg_ids).any())
+    cycles_df = cycles_df[cycles_df.cycle_id.isin(has_fg[has_fg].index)].copy()
+    has_ep = cycles_df.groupby('cycle_id')['location_id'].apply(lambda col: col.isin(preserve_ids).any())
+    cycles_df = cycles_df[cycles_df.cycle_id.isin(has_ep[has_ep].index)].copy()
+    feat = (cycles_df.groupby(['cycle_id', 'location_id'])['dwell']
+            .sum().reset_index()
+            .merge(loc_meta, left_on='location_id', right_on='id', how='left')
+            .pivot_table(index='cycle_id', columns='kind', values='dwell',
+                         aggfunc='sum', fill_value=0))
+    vessel_stats = (cycles_df.groupby('vessel_id')
+                    .apply(lambda g: pd.Series({
+                        'ep_dwell': g[g['location_id'].isin(preserve_ids)]['dwell'].sum(),
+                        'total_dwell': g['dwell'].sum()
+                    }), include_groups=False)
+                    .assign(ep_ratio=lambda x: x['ep_dwell'] / x['total_dwell'])
+                    .sort_values('ep_ratio', ascending=False))
+    return cycles_df, feat, vessel_stats
+
+
+def _filter_features(cycles_df, loc_meta, fg_ids, preserve_ids):
+    from cycle_analysis import filter_cycles_with_features, vessel_preserve_stats
+    cycles_df, feat, _ = filter_cycles_with_features(cycles_df, loc_meta, fg_ids, preserve_ids)
+    return cycles_df, feat, vessel_preserve_stats(cycles_df)
+
+
+def bench_filter_features(n_cycles=100000, large=(1000000,)):
+    """sunburst.py steps 5-7: groupby.apply lambdas vs one flag / sum aggregation"""
+    def run(func, cycles, loc_meta):
+        kinds = loc_meta.set_index('id')['kind']
+        return func(cycles, loc_meta, set(kinds.index[kinds == 'fishing ground']),
+                    set(kinds.index[kinds == 'ecological preserve']))
+
+    cycles, loc_meta = synthetic_cycles(n_cycles)
+    before, expected = timed(run, _filter_features_per_group, cycles, loc_meta)
+    after, result = timed(run, _filter_features, cycles, loc_meta, repeat=3)
+    pd.testing.assert_frame_equal(result[0].drop(columns=['is_fg', 'is_ep']), expected[0])
+    pd.testing.assert_frame_equal(result[1], expected[1])
+    pd.testing.assert_frame_equal(result[2], expected[2])
+    print(f"filter_features: {n_cycles:,} cycles -> {len(result[1]):,} kept (identical output)")
+    print(f"  groupby.apply : {before:8.2f}s")
+    print(f"  aggregation   : {after:8.2f}s  ({before / after:.0f}x)")
+    for size in large:
+        seconds, result = timed(run, _filter_features, *synthetic_cycles(size, n_vessels=50000))
+        print(f"  aggregation   : {seconds:8.2f}s  for {size:,} cycles ({len(result[1]):,} kept)")
+
+
+# ── cluster_linkage ──────────────────────────────────────────────────────────
+
+def bench_cluster_linkage(n_cycles=10000, n_centroids=2000, n_exact=2000):
+    """
+    sunburst.py clustering backends on standardized cycle features, with
+    checks: ward matches scipy, and kmeans / birch (fewer and more BIRCH
+    subclusters than n_centroids) give consistent groups and linkage
+    """
+    from scipy.cluster.hierarchy import linkage
+    from cluster_tree import ClusterTree, cluster_linkage
+
+    X = np.random.default_rng(0).standard_normal((n_cycles, 4))
+    Z, groups = cluster_linkage(X[:n_exact], 'ward', n_centroids=n_exact - 1)
+    assert np.array_equal(Z, linkage(X[:n_exact], method='ward')) and np.array_equal(groups, np.arange(n_exact))
+    print(f"cluster_linkage: {n_cycles:,} cycles, n_centroids={n_centroids:,} (ward on {n_exact:,} matches scipy)")
+
+    cases = [('kmeans', {}),
+             ('birch', {'birch_threshold': 0.5}),  # fewer subclusters than n_centroids
+             ('birch', {'birch_threshold': 0.2})]  # more subclusters: reduced with k-means
+    for method, options in cases:
+        seconds, (Z, groups) = timed(cluster_linkage, X, method, n_centroids, **options)
+        n_groups = len(np.unique(groups))
+        assert len(groups) == n_cycles and groups.max() == n_groups - 1 and n_groups <= n_centroids
+        assert len(Z) == n_groups - 1
+        tree = ClusterTree(Z, groups, np.arange(n_cycles).astype(str), X[:, 0], X[:, 1])
+        assert sorted(tree.leaves.tolist()) == sorted(np.arange(n_cycles).astype(str).tolist())
+        label = method + ''.join(f", {key}={value}" for key, value in options.items())
+        print(f"  {label:<26}: {seconds:8.2f}s  ({n_groups:,} groups)")
+
+
+# ── lcs ──────────────────────────────────────────────────────────────────────
+
+def _lcs_length_dp(seq1, seq2):
+    # Previous implementation: full (m+1) x (n+1) list-of-lists DP
+    m, n = len(seq1), len(seq2)
+    dp = [[0] * (n + 1) for _ in range(m + 1)]
+    for i in range(1, m + 1):
+        for j in range(1, n + 1):
+            if seq1[i-1] == seq2[j-1]:
+                dp[i][j] = dp[i-1][j-1] + 1
+            else:
+                dp[i][j] = max(dp[i-1][j], dp[i][j-1])
+    return dp[m][n]
+
+
+def bench_lcs(sizes=(1000, 3000, 10000, 30000, 100000), dp_limit=3000, n_locations=20):
+    """vessel_similarity.py sequence LCS: 2-D DP vs bit-parallel, on routes of 1k-100k waypoints"""
+    from route_similarity import lcs_length
+
+    rng = np.random.default_rng(0)
+    print(f"lcs: random routes over {n_locations} locations (DP only up to {dp_limit:,} waypoints)")
+    for size in sizes:
+        seq1 = rng.integers(0, n_locations, size).tolist()
+        seq2 = rng.integers(0, n_locations, size).tolist()
+        after, length = timed(lcs_length, seq1, seq2, repeat=3)
+        line = f"  {size:>7,} x {size:<7,} bit-parallel {after:8.4f}s  (lcs {length:,})"
+        if size <= dp_limit:
+            before, expected = timed(_lcs_length_dp, seq1, seq2)
+            assert length == expected
+            line += f"   DP {before:8.2f}s  ({before / after:,.0f}x)"
+        print(line)
+
+
+# ── similarity_matrix ────────────────────────────────────────────────────────
+
+def synthetic_routes(n_vessels, n_points=300, seed=0):
+    """Routes in the layout of ping_store.load_fishing_routes()['fishing_vessels']"""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2035-02-01').value
+    vessels = []
+    for v in range(n_vessels):
+        times = pd.to_datetime(np.sort(start + rng.integers(0, 300 * 86400 * 10**9, n_points)))
+        route = [{'time': t, 'location': loc, 'dwell': float(d)}
+                 for t, loc, d in zip(times.strftime('%Y-%m-%dT%H:%M:%S.%f'),
+                                      rng.choice(PORTS + SEA, n_points), rng.random(n_points) * 50000)]
+        vessels.append({'vessel_id': f'vessel{v}', 'company': f'Co{v % 7}', 'route': route,
+                        'route_points': n_points})
+    return {'total_fishing_vessels': n_vessels, 'fishing_vessels': vessels}
+
+
+def bench_similarity_matrix(n_vessels=400, workers=(1, 2, 4)):
+    """vessel_similarity.py all-pairs protected similarity: serial loop vs tiled process pool"""
+    import os
+    from route_similarity import calculate_protected_similarity, protected_similarity_matrix
+    from vessel_similarity import build_vessel_features
+
+    _, _, codes = build_vessel_features(synthetic_routes(n_vessels))
+    features = list(codes.values())
+
+    def serial_loop():
+        matrix = np.zeros((n_vessels, n_vessels))
+        for i in range(n_vessels):
+            for j in range(i, n_vessels):
+                matrix[i, j] = matrix[j, i] = calculate_protected_similarity(features[i], features[j])
+        return matrix
+
+    before, expected = timed(serial_loop)
+    print(f"similarity_matrix: {n_vessels:,} vessels, {n_vessels * (n_vessels + 1) // 2:,} pairs "
+          f"({os.cpu_count()} cores)")
+    print(f"  serial loop      : {before:8.2f}s")
+    for count in workers:
+        seconds, matrix = timed(protected_similarity_matrix, features, workers=count, progress=False)
+        assert np.array_equal(matrix, expected)
+        print(f"  tiled, {count:2d} worker(s): {seconds:8.2f}s  ({before / seconds:.1f}x)")
+
+
+# ── lsh ──────────────────────────────────────────────────────────────────────
+
+def synthetic_route_families(n_vessels, n_families=40, seed=0):
+    """Like synthetic_routes, but every vessel follows one of `n_families` location mixes and route lengths"""
+    rng = np.random.default_rng(seed)
+    locations = np.array(PORTS + SEA)
+    mixes = rng.dirichlet(np.full(len(locations), 0.3), n_families)
+    lengths = rng.integers(50, 400, n_families)
+    start = pd.Timestamp('2035-02-01').value
+    vessels = []
+    for v in range(n_vessels):
+        family = rng.integers(n_families)
+        n_points = lengths[family]
+        times = pd.to_datetime(np.sort(start + rng.integers(0, 300 * 86400 * 10**9, n_points)))
+        route = [{'time': t, 'location': loc, 'dwell': float(d)}
+                 for t, loc, d in zip(times.strftime('%Y-%m-%dT%H:%M:%S.%f'),
+                                      rng.choice(locations, n_points, p=mixes[family]),
+                                      rng.random(n_points) * 50000)]
+        vessels.append({'vessel_id': f'vessel{v}', 'company': f'Co{v % 7}', 'route': route,
+                        'route_points': n_points})
+    return {'total_fishing_vessels': n_vessels, 'fishing_vessels': vessels}
+
+
+def bench_lsh(n_vessels=1000, top_k=(1, 10)):
+    """vessel_similarity.py sequence similarity: exact all pairs vs MinHash/LSH candidates only"""
+    from route_similarity import (RouteLSHIndex, candidate_recall, protected_similarity_matrix,
+                                  protected_similarity_pairs)
+    from vessel_similarity import build_vessel_features
+
+    _, _, codes = build_vessel_features(synthetic_route_families(n_vessels))
+    features = list(codes.values())
+    exact_seconds, exact = timed(protected_similarity_matrix, features, progress=False)
+    index_seconds, index = timed(RouteLSHIndex, features)
+    left, right = index.candidate_pairs()
+    lsh_seconds, approx = timed(protected_similarity_pairs, features, left, right, progress=False)
+    print(f"lsh: {n_vessels:,} vessels in route families")
+    print(f"  exact, all pairs     : {exact_seconds:8.2f}s")
+    print(f"  LSH index            : {index_seconds:8.2f}s")
+    print(f"  exact on candidates  : {lsh_seconds:8.2f}s  ({exact_seconds / (index_seconds + lsh_seconds):.1f}x "
+          f"incl. index)")
+    for k in top_k:
+        recall, candidate_share = candidate_recall(index, exact, k)
+        print(f"  recall@{k:<3d}          : {recall:8.3f}  (candidates: {candidate_share:.1%} of all pairs)")
+    print(f"  max |error| on candidate pairs: {np.abs(approx - exact[left, right]).max(initial=0):.1e}")
+
+
+# ── route_features ───────────────────────────────────────────────────────────
+
+def synthetic_route_table(n_points, n_vessels=5000, seed=0):
+    """RouteTable of a fleet: vessels' points in time order over PORTS + SEA"""
+    from route_features import RouteTable
+
+    rng = np.random.default_rng(seed)
+    vessel = np.sort(rng.integers(0, n_vessels, n_points))
+    start = pd.Timestamp('2035-02-01').value
+    time = start + rng.integers(0, 300 * 86400 * 10**9, n_points)
+    time = time[np.lexsort((time, vessel))]
+    return RouteTable([f'vessel{i}' for i in range(n_vessels)], sorted(PORTS + SEA), vessel,
+                      rng.integers(0, len(PORTS + SEA), n_points), time,
+                      (rng.random(n_points) * 50000).astype(np.float32))
+
+
+def _route_stats_per_point(route):
+    # Previous implementation (vessel_similarity.route_stats): string-split
+    # every time, then NumPy on one vessel's lists
+    locations, dwell_times, times = set(), [], []
+    for point in route:
+        locations.add(point['location'])
+        dwell_times.append(point['dwell'])
+        time_parts = point['time'].split('T')[1].split('.')[0].split(':')
+        times.append(float(time_parts[0]) + float(time_parts[1])/60 + float(time_parts[2])/3600)
+    return {
+        'num_locations': len(locations),
+        'avg_dwell': np.mean(dwell_times) if dwell_times else 0,
+        'std_dwell': np.std(dwell_times) if dwell_times else 0,
+        'max_dwell': max(dwell_times) if dwell_times else 0,
+        'min_dwell': min(dwell_times) if dwell_times else 0,
+        'avg_time': np.mean(times) if times else 0,
+        'std_time': np.std(times) if times else 0,
+    }
+
+
+def bench_route_features(n_points=1000000, large=(10000000,)):
+    """vessel_similarity.py basic features: per-point loops vs grouped reductions on a RouteTable"""
+    from route_features import RouteTable, vessel_route_stats
+
+    table = synthetic_route_table(n_points)
+    times = pd.to_datetime(table.time).strftime('%Y-%m-%dT%H:%M:%S.%f').to_numpy()
+    fishing_vessels = [{'vessel_id': vessel_id,
+                        'route': [{'time': t, 'location': loc, 'dwell': d} for t, loc, d in
+                                  zip(times[lo:hi], table.locations[table.location[lo:hi]].tolist(),
+                                      table.dwell[lo:hi].tolist())]}
+                       for vessel_id, lo, hi in zip(table.vessel_ids, table.offsets[:-1], table.offsets[1:])]
+
+    def per_point():
+        return pd.DataFrame([_route_stats_per_point(vessel['route']) for vessel in fishing_vessels],
+                            index=pd.Index(table.vessel_ids, name='vessel_id'))
+
+    before, expected = timed(per_point)
+    convert, routes = timed(RouteTable.from_routes, fishing_vessels)
+    after, stats = timed(vessel_route_stats, routes, repeat=3)
+    pd.testing.assert_frame_equal(stats, expected, check_exact=True)
+    print(f"route_features: {n_points:,} waypoints, {len(table.vessel_ids):,} vessels (identical output)")
+    print(f"  per-point loops      : {before:8.2f}s")
+    print(f"  route dicts -> table : {convert:8.2f}s")
+    print(f"  grouped reductions   : {after:8.2f}s  ({before / after:.0f}x, {before / (convert + after):.1f}x "
+          f"incl. table)")
+    for size in large:
+        seconds, stats = timed(vessel_route_stats, synthetic_route_table(size))
+        print(f"  grouped reductions   : {seconds:8.2f}s  for {size:,} waypoints ({len(stats):,} vessels)")
+
+
+# ── route_store ──────────────────────────────────────────────────────────────
+
+def bench_route_store(n_points=1000000):
+    """fishing_vessel_routes.json vs the compact route file: size, full load, one-vessel slice"""
+    import json
+    import os
+    import tempfile
+    from route_store import MISSING, CompactRoutes, write_compact_routes
+
+    table = synthetic_route_table(n_points)
+    times = pd.to_datetime(table.time).strftime('%Y-%m-%dT%H:%M:%S.%f').to_numpy()
+    vessel_ids, locations = table.vessel_ids[table.vessel], table.locations[table.location]
+    vessels = [{'vessel_id': vessel_id, 'company': f'Co{i % 7}'} for i, vessel_id in enumerate(table.vessel_ids)]
+    target = table.vessel_ids[len(vessels) // 2]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path, npz_path = os.path.join(tmp, 'routes.json'), os.path.join(tmp, 'routes.npz')
+        fishing_vessels = [{**vessel, 'route_points': int(hi - lo),
+                            'route': [{'time': t, 'location': loc, 'dwell': d, 'latitude': MISSING,
+                                       'longitude': MISSING}
+                                      for t, loc, d in zip(times[lo:hi], locations[lo:hi].tolist(),
+                                                           table.dwell[lo:hi].tolist())]}
+                           for vessel, lo, hi in zip(vessels, table.offsets[:-1], table.offsets[1:])]
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({'total_fishing_vessels': len(vessels), 'fishing_vessels': fishing_vessels}, f, indent=2,
+                      ensure_ascii=False)
+        del fishing_vessels
+        write_compact_routes(npz_path, vessels, vessel_ids, locations, times, table.dwell)
+
+        def load_json_vessel():
+            with open(json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return next(v['route'] for v in data['fishing_vessels'] if v['vessel_id'] == target)
+
+        json_seconds, route = timed(load_json_vessel)
+        open_seconds, routes = timed(CompactRoutes, npz_path, repeat=3)
+        slice_seconds, points = timed(routes.vessel, target, repeat=3)
+        table_seconds, _ = timed(routes.table, repeat=3)
+        assert len(points) == len(route) and points['location'].tolist() == [p['location'] for p in route]
+        print(f"route_store: {n_points:,} waypoints, {len(vessels):,} vessels")
+        print(f"  JSON (indent=2)    : {os.path.getsize(json_path) / 2**20:8.1f} MiB, "
+              f"{json_seconds:6.2f}s to load it for one vessel")
+        print(f"  compact .npz       : {os.path.getsize(npz_path) / 2**20:8.1f} MiB, "
+              f"open {open_seconds * 1000:.1f} ms + one vessel {slice_seconds * 1000:.1f} ms "
+              f"(mmap, {len(points):,} points)")
+        print(f"  compact full table : {table_seconds:6.2f}s")
+
+
+# ── extract_routes ───────────────────────────────────────────────────────────
+
+def bench_extract_routes(n_pings=1000000, workers=(2, 4)):
+    """extract_vessel_routes.py: single-process dict building vs sharded workers (JSON and npz output)"""
+    import os
+    import tempfile
+    from extract_vessel_routes import extract_sharded, write_compact_output, write_json_output
+
+    fleet = synthetic_fleet_pings(n_pings, n_vessels=5000)
+    pings = {'time': fleet['time'].dt.strftime('%Y-%m-%dT%H:%M:%S.%f').tolist(),
+             'source': fleet['location_id'].tolist(), 'target': fleet['vessel_id'].tolist(),
+             'dwell': fleet['dwell'].tolist(), 'latitude': ['未知'] * n_pings, 'longitude': ['未知'] * n_pings}
+    vessel_info = {vessel_id: dict.fromkeys(('company', 'tonnage', 'length', 'flag_country', 'date_added',
+                                             'last_edited_date', 'raw_source'), '未知')
+                   for vessel_id in fleet['vessel_id'].unique()}
+
+    print(f"extract_routes: {n_pings:,} pings, {len(vessel_info):,} vessels ({os.cpu_count()} cores)")
+    with tempfile.TemporaryDirectory() as tmp:
+        for output_format, write in (('json', write_json_output), ('npz', write_compact_output)):
+            reference = os.path.join(tmp, f'single.{output_format}')
+            before, _ = timed(write, reference, vessel_info, pings)
+            print(f"  {output_format}, single process : {before:8.2f}s")
+            for count in workers:
+                path = os.path.join(tmp, f'sharded{count}.{output_format}')
+                seconds, (_, stages) = timed(extract_sharded, pings, vessel_info, path, output_format, count)
+                if output_format == 'json':
+                    with open(reference, 'rb') as f, open(path, 'rb') as g:
+                        assert f.read() == g.read()
+                stages = ', '.join(f"{stage} {stage_seconds:.2f}s" for stage, stage_seconds in stages.items())
+                print(f"  {output_format}, {count} shards      : {seconds:8.2f}s  ({before / seconds:.1f}x; {stages})")
+
+
+# ── route_merge ──────────────────────────────────────────────────────────────
+
+def bench_route_merge(n_points=2000000, delta_share=0.01):
+    """extract_vessel_routes.py --update: rewrite the compact route file vs merge a day's delta into it"""
+    import os
+    import tempfile
+    from route_store import CompactRoutes, merge_compact_routes, write_compact_routes
+
+    table = synthetic_route_table(n_points)
+    times = pd.to_datetime(table.time).strftime('%Y-%m-%dT%H:%M:%S.%f').to_numpy()
+    vessel_ids, locations = table.vessel_ids[table.vessel], table.locations[table.location]
+    vessels = [{'vessel_id': vessel_id, 'last_edited_date': '2035-01-01'} for vessel_id in table.vessel_ids]
+    is_delta = np.random.default_rng(1).random(n_points) < delta_share
+    old, new = ~is_delta, is_delta
+    updated = [{'vessel_id': vessel_id, 'last_edited_date': '2035-12-01'} for vessel_id in table.vessel_ids[::10]]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        full_path, merged_path = os.path.join(tmp, 'full.npz'), os.path.join(tmp, 'merged.npz')
+        rewrite, _ = timed(write_compact_routes, full_path, vessels, vessel_ids, locations, times, table.dwell)
+        write_compact_routes(merged_path, vessels, vessel_ids[old], locations[old], times[old], table.dwell[old])
+        merge, (added, touched) = timed(merge_compact_routes, merged_path, updated, vessel_ids[new],
+                                        locations[new], times[new], table.dwell[new])
+        full, merged = CompactRoutes(full_path), CompactRoutes(merged_path)
+        assert all(np.array_equal(getattr(full, name), getattr(merged, name))
+                   for name in ('offsets', 'location', 'time_delta', 'dwell'))
+    print(f"route_merge: {n_points:,} waypoints, delta of {added:,} points on {touched:,} vessels (identical arrays)")
+    print(f"  rewrite from all points : {rewrite:8.2f}s")
+    print(f"  merge the delta         : {merge:8.2f}s  ({rewrite / merge:.1f}x)")
+
+
+
+# ── route_filter ─────────────────────────────────────────────────────────────
+
+def bench_route_filter(n_points=5000000, n_targets=48):
+    """
+    Load 48 vessels / one month: filter after reading everything vs prune
+    while reading (ping_store.load_pings, route_store.CompactRoutes.select)
+    """
+    import os
+    import tempfile
+    import ping_store
+    from route_store import CompactRoutes, write_sorted_routes
+
+    table = synthetic_route_table(n_points)
+    pings = pd.DataFrame({'vessel_id': pd.Categorical.from_codes(table.vessel, table.vessel_ids),
+                          'location_id': pd.Categorical.from_codes(table.location, table.locations),
+                          'time': table.time, 'dwell': table.dwell})
+    targets = set(np.random.default_rng(1).choice(table.vessel_ids, n_targets, replace=False))
+    start, end = pd.Timestamp('2035-05-01'), pd.Timestamp('2035-06-01')
+    queries = {f'{n_targets} vessels': dict(vessel_ids=targets),
+               'one month': dict(start=start, end=end),
+               f'{n_targets} vessels, one month': dict(vessel_ids=targets, start=start, end=end)}
+
+    def read_and_mask(read, vessel_ids=None, start=None, end=None):
+        df = read()
+        keep = np.ones(len(df), dtype=bool)
+        if vessel_ids is not None:
+            keep &= df['vessel_id'].isin(vessel_ids).to_numpy()
+        if start is not None:
+            keep &= df['time'].to_numpy() >= start.value
+        if end is not None:
+            keep &= df['time'].to_numpy() < end.value
+        return df[keep].reset_index(drop=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'mc2.json')  # absent: the store is used as is
+        ping_store.write_pings(pings, tmp)
+        with open(os.path.join(tmp, ping_store.META_FILE), 'w', encoding='utf-8') as f:
+            f.write('{}')
+        route_path = os.path.join(tmp, 'routes.npz')
+        write_sorted_routes(route_path, [{'vessel_id': vessel_id} for vessel_id in table.vessel_ids],
+                            table.offsets, table.locations, table.location, table.time, table.dwell,
+                            np.full(len(table), np.nan), np.full(len(table), np.nan))
+
+        print(f"route_filter: {n_points:,} pings of {len(table.vessel_ids):,} vessels")
+        for name, query in queries.items():
+            full, expected = timed(read_and_mask, lambda: ping_store.load_pings(source, tmp), repeat=3,
+                                   **query)
+            pruned, result = timed(ping_store.load_pings, source, tmp, repeat=3, **query)
+            assert result.astype(object).equals(expected.astype(object))
+
+            def route_frame():
+                routes = CompactRoutes(route_path).table()
+                return pd.DataFrame({'vessel_id': routes.vessel_ids[routes.vessel], 'time': routes.time})
+            route_full, route_expected = timed(read_and_mask, route_frame, repeat=3, **query)
+            route_pruned, selected = timed(lambda: CompactRoutes(route_path).select(**query), repeat=3)
+            assert np.array_equal(selected.time, route_expected['time'].to_numpy())
+            print(f"  {name} ({len(result):,} pings)")
+            print(f"    ping store  read all + mask : {full:8.2f}s   pruned read : {pruned:8.2f}s "
+                  f"({full / pruned:.1f}x)")
+            print(f"    route file  read all + mask : {route_full:8.2f}s   select      : {route_pruned:8.2f}s "
+                  f"({route_full / route_pruned:.1f}x)")
+
+
+BENCHMARKS = {
+    'cluster_linkage': bench_cluster_linkage,
+    'dwell_render': bench_dwell_render,
+    'extract_routes': bench_extract_routes,
+    'filter_features': bench_filter_features,
+    'lcs': bench_lcs,
+    'lsh': bench_lsh,
+    'parse_pings': bench_parse_pings,
+    'route_features': bench_route_features,
+    'route_filter': bench_route_filter,
+    'route_merge': bench_route_merge,
+    'route_store': bench_route_store,
+    'similarity_matrix': bench_similarity_matrix,
+    'split_cycles': bench_split_cycles,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run analysis micro-benchmarks')
+    parser.add_argument('names', nargs='*',
+                        help=f"benchmarks to run (default: all of {', '.join(sorted(BENCHMARKS))})")
+    parser.add_argument('--pings', type=int, metavar='N',
+                        help='edges for parse_pings (default 2,000)')
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+    for name in args.names or sorted(BENCHMARKS):
+        if name == 'parse_pings' and args.pings:
+            BENCHMARKS[name](args.pings)
+        else:
+            BENCHMARKS[name]()
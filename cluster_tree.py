@@ -0,0 +1,213 @@
+"""
+Hierarchical clustering of fishing cycles for the sunburst (sunburst.py).
+
+`cluster_linkage` clusters the standardized cycle features with one of
+the CLUSTER_METHODS:
+
+    ward    Ward linkage on every cycle (exact, O(n²) memory)
+    kmeans  mini-batch k-means into at most `n_centroids` groups, then Ward
+            on the group centroids
+    birch   BIRCH into at most `n_centroids` groups, then Ward on the group
+            centroids
+
+and `ClusterTree` turns the result into the sunburst tree as flat arrays,
+without recursion, so deep trees do not hit Python's recursion limit.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy.cluster.hierarchy import linkage
+
+CLUSTER_METHODS = ('ward', 'kmeans', 'birch')
+
+
+def _group_centroids(X, groups):
+    """Renumber `groups` to 0..k-1 and return (groups, centroids)"""
+    _, groups = np.unique(groups, return_inverse=True)
+    sizes = np.bincount(groups)
+    centroids = np.stack([np.bincount(groups, weights=X[:, j]) for j in range(X.shape[1])], axis=1)
+    return groups, centroids / sizes[:, None]
+
+
+def cluster_linkage(X, method='ward', n_centroids=2000, birch_threshold=0.5, seed=0):
+    """
+    Cluster the rows of X.
+
+    Returns (Z, groups): a scipy linkage matrix and, per row, the linkage
+    leaf it belongs to. With 'ward' every row is its own leaf; the other
+    methods only run Ward on the pre-cluster centroids, so memory stays
+    bounded by `n_centroids` (BIRCH may leave fewer groups: its
+    subclusters, when there are no more than `n_centroids` of them).
+    """
+    if method not in CLUSTER_METHODS:
+        raise ValueError(f"unknown cluster method {method!r}, expected one of {CLUSTER_METHODS}")
+    X = np.asarray(X, dtype=float)
+    if method == 'ward' or len(X) <= n_centroids:
+        return linkage(X, method='ward'), np.arange(len(X))
+
+    from sklearn.cluster import Birch, MiniBatchKMeans
+
+    def kmeans(n_clusters):
+        return MiniBatchKMeans(n_clusters=n_clusters, random_state=seed, n_init=3,
+                               batch_size=max(1024, 4 * n_clusters))
+
+    if method == 'birch':
+        # BIRCH without its global step (agglomerative, O(k²) in subclusters):
+        # the subclusters are the groups, reduced with k-means only when
+        # there are more than n_centroids of them
+        birch = Birch(threshold=birch_threshold, n_clusters=None).fit(X)
+        labels = birch.labels_
+        n_subclusters = len(birch.subcluster_centers_)
+        if n_subclusters > n_centroids:
+            labels = kmeans(min(n_centroids, n_subclusters)).fit_predict(birch.subcluster_centers_)[labels]
+    else:
+        labels = kmeans(n_centroids).fit_predict(X)
+    groups, centroids = _group_centroids(X, labels)
+    if len(centroids) < 2:
+        # Everything fell into one group: a single merge-free leaf
+        return np.zeros((0, 4)), groups
+    return linkage(centroids, method='ward'), groups
+
+
+class ClusterTree:
+    """
+    The sunburst cluster tree as flat arrays, in pre-order (root first,
+    left subtree before right).
+
+    Leaves are cycles; internal nodes carry the weight-averaged color / ep
+    of their children (weight = number of cycles below). Leaves are stored
+    contiguously in `leaves`, so the cycles under node i are
+    `leaves[leaf_start[i]:leaf_end[i]]`.
+
+    Built with one bottom-up pass over the linkage rows (which are in merge
+    order) and one top-down pass assigning pre-order positions and leaf
+    ranges; nothing recurses. Pre-cluster groups with more than one cycle
+    become an extra level holding their cycles.
+    """
+
+    def __init__(self, Z, groups, labels, color, ep):
+        groups = np.asarray(groups, dtype=int)
+        n = len(groups)
+        group_size = np.bincount(groups)
+
+        # Node numbers in creation order: cycles, multi-cycle groups, linkage merges
+        multi = np.flatnonzero(group_size > 1)
+        first_merge = n + len(multi)
+        n_nodes = first_merge + len(Z)
+        node_of = np.empty(len(group_size) + len(Z), dtype=int)  # linkage index -> node
+        single_rows = np.flatnonzero(group_size[groups] == 1)
+        node_of[groups[single_rows]] = single_rows
+        node_of[multi] = n + np.arange(len(multi))
+        node_of[len(group_size):] = first_merge + np.arange(len(Z))
+        children = node_of[Z[:, :2].astype(int)].tolist()
+
+        # Bottom-up: groups are plain means of their cycles, merges weighted averages
+        weight = np.ones(n_nodes)
+        color = np.r_[np.asarray(color, dtype=float), np.zeros(n_nodes - n)]
+        ep = np.r_[np.asarray(ep, dtype=float), np.zeros(n_nodes - n)]
+        size = np.ones(n_nodes, dtype=int)  # nodes in each subtree
+        group_nodes = node_of[multi]
+        weight[group_nodes] = group_size[multi]
+        color[group_nodes] = np.bincount(groups, weights=color[:n])[multi] / group_size[multi]
+        ep[group_nodes] = np.bincount(groups, weights=ep[:n])[multi] / group_size[multi]
+        size[group_nodes] = group_size[multi] + 1
+
+        w, c, e, s = weight.tolist(), color.tolist(), ep.tolist(), size.tolist()
+        for node, (left, right) in enumerate(children, first_merge):
+            w[node] = w[left] + w[right]
+            c[node] = (c[left] * w[left] + c[right] * w[right]) / w[node]
+            e[node] = (e[left] * w[left] + e[right] * w[right]) / w[node]
+            s[node] = 1 + s[left] + s[right]
+
+        # Top-down: pre-order position, first leaf and parent of every node
+        pre, first_leaf, parent = [0] * n_nodes, [0] * n_nodes, [-1] * n_nodes
+        for node in range(n_nodes - 1, first_merge - 1, -1):
+            left, right = children[node - first_merge]
+            pre[left], pre[right] = pre[node] + 1, pre[node] + 1 + s[left]
+            first_leaf[left], first_leaf[right] = first_leaf[node], first_leaf[node] + int(w[left])
+            parent[left] = parent[right] = node
+        pre, first_leaf, parent = np.array(pre), np.array(first_leaf), np.array(parent)
+
+        # Cycles of a multi-cycle group follow it, in row order
+        rows = np.flatnonzero(group_size[groups] > 1)
+        rows = rows[np.argsort(groups[rows], kind='stable')]
+        owner = node_of[groups[rows]]
+        rank = np.arange(len(rows)) - np.searchsorted(groups[rows], groups[rows])
+        pre[rows] = pre[owner] + 1 + rank
+        first_leaf[rows] = first_leaf[owner] + rank
+        parent[rows] = owner
+
+        # Store everything in pre-order
+        by_pre = np.argsort(pre)
+        self.parents = np.where(parent[by_pre] >= 0, pre[parent[by_pre]], -1)
+        self.weight = np.array(w)[by_pre]
+        self.size = np.array(s)[by_pre]
+        self.color = np.array(c)[by_pre]
+        self.ep = np.array(e)[by_pre]
+        self.leaf_start = first_leaf[by_pre]
+        self.leaf_end = self.leaf_start + self.weight.astype(int)
+        self.is_leaf = by_pre < n
+        self.leaves = np.empty(n, dtype=object)
+        self.leaves[first_leaf[:n]] = np.asarray(labels, dtype=object)
+        self.ids = np.array([f"cluster_{i}" for i in range(n_nodes)], dtype=object)
+        self.ids[self.is_leaf] = self.leaves[self.leaf_start[self.is_leaf]]
+        depth = [0] * n_nodes
+        for node, up in enumerate(self.parents.tolist()[1:], 1):
+            depth[node] = depth[up] + 1
+        self.depth = np.array(depth)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def clusters(self):
+        """Pre-order positions of the internal nodes"""
+        return np.flatnonzero(~self.is_leaf)
+
+    def cluster_leaves(self, node):
+        return self.leaves[self.leaf_start[node]:self.leaf_end[node]]
+
+    def explorer_payload(self, leaf_vessels):
+        """
+        Compact cluster explorer data: every cycle id and vessel name once,
+        cycles as integer vessel codes in leaf order, and the [start, end)
+        leaf range of every node by pre-order index (node i is "cluster_i").
+        `leaf_vessels` gives the vessel of each entry of `leaves`.
+        """
+        vessel_codes, vessels = pd.factorize(pd.Series(leaf_vessels), sort=True)
+        return {'cycles': self.leaves.tolist(),
+                'vessels': vessels.tolist(),
+                'cycleVessel': vessel_codes.tolist(),
+                'start': self.leaf_start.tolist(),
+                'end': self.leaf_end.tolist()}
+
+    def collapsed(self, max_depth=None, min_cluster_size=1):
+        """
+        Mask of the internal nodes drawn as summary nodes: those at
+        `max_depth` or with fewer than `min_cluster_size` cycles.
+        """
+        collapsed = ~self.is_leaf & (self.weight < min_cluster_size)
+        if max_depth is not None:
+            collapsed |= ~self.is_leaf & (self.depth >= max_depth)
+        return collapsed
+
+    def to_frame(self, max_depth=None, min_cluster_size=1):
+        """
+        id / parent / value / color / ep / cycles rows for px.sunburst.
+
+        Subtrees below collapsed nodes (see `collapsed`) are left out; a
+        collapsed node keeps its weighted color / ep and takes the value of
+        its whole subtree, so the rings keep their proportions.
+        """
+        collapsed = self.collapsed(max_depth, min_cluster_size)
+        # Pre-order: a node is hidden when its parent is collapsed or hidden
+        hidden = np.zeros(len(self), dtype=bool)
+        blocked = collapsed.copy()
+        for node, up in enumerate(self.parents.tolist()[1:], 1):
+            if blocked[up]:
+                hidden[node] = blocked[node] = True
+        shown = ~hidden
+        parent_ids = np.where(self.parents >= 0, self.ids[self.parents], "")
+        return pd.DataFrame({'id': self.ids[shown], 'parent': parent_ids[shown],
+                             'value': np.where(collapsed, self.size, 1)[shown],
+                             'color': self.color[shown], 'ep': self.ep[shown],
+                             'cycles': self.weight[shown].astype(int)})
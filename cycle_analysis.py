@@ -0,0 +1,130 @@
+"""
+Columnar building blocks of the fishing-cycle sunburst (sunburst.py).
+
+Everything here works on whole ping / cycle tables at once so the
+pipeline scales linearly with the number of pings.
+"""
+
+import numpy as np
+import pandas as pd
+
+from ping_store import resolve_ping_orientation
+
+PING_COLUMNS = ['vessel_id', 'location_id', 'time', 'dwell']
+
+
+def parse_pings(ping_edges, vessel_ids):
+    """
+    Turn TransponderPing edges into a vessel_id / location_id / time / dwell table.
+
+    Edges may point either way; an edge is kept when exactly one endpoint is
+    a vessel, and that endpoint becomes vessel_id. Times are parsed in one
+    bulk call (unparseable -> NaT) and a missing dwell column counts as 0.
+    """
+    vessel_id, location_id, keep = resolve_ping_orientation(
+        ping_edges['source'].to_numpy(dtype=object), ping_edges['target'].to_numpy(dtype=object),
+        vessel_ids)
+    kept = ping_edges[keep]
+    if 'dwell' in kept:
+        dwell = kept['dwell'].astype(float).to_numpy()
+    else:
+        dwell = np.zeros(len(kept))
+    return pd.DataFrame({
+        'vessel_id': vessel_id,
+        'location_id': location_id,
+        'time': pd.to_datetime(kept['time'], errors='coerce', format='ISO8601').to_numpy(),
+        'dwell': dwell,
+    })
+
+
+def split_cycles(pings, port_ids, min_pings):
+    """
+    Split every vessel's time-sorted pings into port-to-port cycles.
+
+    A cycle starts at the first non-port ping after a port visit (or at the
+    vessel's first non-port ping) and is closed by the next port ping; it is
+    kept when it has at least `min_pings` pings. Trips that never return to
+    a port are dropped. Cycles are numbered 1, 2, ... per vessel, giving
+    cycle ids "<vessel_id>_<n>". Vessels keep their order of first
+    appearance in `pings`.
+    """
+    vessel_codes = pd.factorize(pings['vessel_id'])[0]
+    times = pd.to_datetime(pings['time'])
+    # Stable (vessel, time) order with unparseable times last, as sort_values does
+    time_key = np.where(times.isna(), np.iinfo(np.int64).max, times.to_numpy().view(np.int64))
+    order = np.lexsort((time_key, vessel_codes))
+    df = pings[PING_COLUMNS].iloc[order].reset_index(drop=True)
+    n = len(df)
+    vessel = vessel_codes[order]
+    is_port = df['location_id'].isin(port_ids).to_numpy()
+
+    # Ports seen before each row within its vessel = the trip segment the row belongs to
+    vessel_start = np.r_[True, vessel[1:] != vessel[:-1]] if n else np.zeros(0, dtype=bool)
+    ports_seen = np.cumsum(is_port) - is_port
+    first_row = np.maximum.accumulate(np.where(vessel_start, np.arange(n), 0))
+    segment = ports_seen - ports_seen[first_row]
+
+    # A segment is a finished trip only if a later port ping closes it
+    vessel_ports = np.bincount(vessel, weights=is_port, minlength=vessel.max() + 1 if n else 0)
+    in_trip = ~is_port & (segment < vessel_ports[vessel])
+
+    trips = df[in_trip]
+    trip_vessel, trip_segment = vessel[in_trip], segment[in_trip]
+    trip_start = np.r_[True, (trip_vessel[1:] != trip_vessel[:-1]) | (trip_segment[1:] != trip_segment[:-1])] \
+        if len(trips) else np.zeros(0, dtype=bool)
+    trip_no = np.cumsum(trip_start)
+    trip_size = np.bincount(trip_no)[trip_no] if len(trips) else np.zeros(0, dtype=int)
+
+    # Apply MIN_PINGS through the trip sizes, then number the kept trips per vessel
+    keep = trip_size >= min_pings
+    cycles = trips[keep].reset_index(drop=True)
+    kept_vessel, kept_start = trip_vessel[keep], trip_start[keep]
+    kept_no = np.cumsum(kept_start)
+    first_of_vessel = np.r_[True, kept_vessel[1:] != kept_vessel[:-1]] if len(cycles) else kept_start
+    vessel_base = np.maximum.accumulate(np.where(first_of_vessel, kept_no - 1, 0))
+    cycle_no = kept_no - vessel_base
+
+    cycles['cycle_id'] = cycles['vessel_id'].astype(str) + '_' + pd.Series(cycle_no, dtype=str)
+    return cycles
+
+
+def filter_cycles_with_features(cycles_df, loc_meta, fg_ids, preserve_ids):
+    """
+    Keep the cycles that visit both a fishing ground and a preserve, and
+    build their dwell-per-location-kind feature matrix.
+
+    The is_fg / is_ep flags are computed once per row and reduced per
+    cycle with a single groupby `any`; the feature pivot is a groupby `sum`
+    over (cycle, location) followed by one over (cycle, kind), which is what
+    pivot_table does without its per-call overhead.
+
+    Returns (cycles_df, feat, counts): the kept cycle rows with added
+    is_fg / is_ep columns, the cycle x kind dwell matrix, and the number of
+    cycles before filtering, with a fishing ground, and with both.
+    """
+    cycles_df = cycles_df.assign(is_fg=cycles_df['location_id'].isin(fg_ids),
+                                 is_ep=cycles_df['location_id'].isin(preserve_ids))
+    # Factorize the cycle ids once; every grouping below works on the integer codes
+    cycle_codes, cycle_ids = pd.factorize(cycles_df['cycle_id'], sort=True)
+    visits = cycles_df[['is_fg', 'is_ep']].groupby(cycle_codes).any()
+    keep = (visits['is_fg'] & visits['is_ep']).to_numpy()
+    counts = dict(all=len(visits), with_fg=int(visits['is_fg'].sum()), with_ep=int(keep.sum()))
+    keep_row = keep[cycle_codes]
+    cycles_df, cycle_codes = cycles_df[keep_row], cycle_codes[keep_row]
+
+    feat = (cycles_df.groupby([pd.Series(cycle_codes, index=cycles_df.index, name='cycle'), 'location_id'])
+            ['dwell'].sum().reset_index()
+            .merge(loc_meta, left_on='location_id', right_on='id', how='left')
+            .groupby(['cycle', 'kind'])['dwell'].sum()
+            .unstack(fill_value=0))
+    feat.index = pd.Index(cycle_ids[feat.index], name='cycle_id')
+    return cycles_df, feat, counts
+
+
+def vessel_preserve_stats(cycles_df):
+    """Per-vessel preserve dwell, total dwell and their ratio, riskiest first"""
+    return (cycles_df.assign(ep_dwell=cycles_df['dwell'].where(cycles_df['is_ep'], 0))
+            .rename(columns={'dwell': 'total_dwell'})
+            .groupby('vessel_id')[['ep_dwell', 'total_dwell']].sum()
+            .assign(ep_ratio=lambda x: x['ep_dwell'] / x['total_dwell'])
+            .sort_values('ep_ratio', ascending=False))
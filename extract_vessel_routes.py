@@ -1,81 +1,357 @@
+import argparse
+import heapq
 import json
+import os
 import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from collections import defaultdict
 
-def extract_vessel_routes():
+import numpy as np
+import pandas as pd
+
+from mc2_loader import FISHING_VESSEL, TRANSPONDER_PING, PingSink, RecordSink, load_mc2
+from route_store import (CompactRoutes, merge_compact_routes, parse_route_times, warn_invalid_times,
+                         write_compact_routes, write_sorted_routes)
+
+DATA_FILE = 'MC2/mc2.json'
+OUTPUT_FORMATS = ('json', 'npz')
+
+
+def read_vessel_pings(json_path=DATA_FILE):
+    """流式读取图文件：只保留渔船节点和定位事件，返回 (渔船信息, 定位事件列)"""
+    vessel_sink = RecordSink()
+    ping_sink = PingSink(extra_fields=('latitude', 'longitude'),
+                         defaults={'latitude': '未知', 'longitude': '未知'})
+    load_mc2(json_path,
+             node_sinks={FISHING_VESSEL: vessel_sink},
+             link_sinks={TRANSPONDER_PING: ping_sink})
+
+    # 创建渔船ID到渔船信息的映射
+    vessel_info = {}
+    for node in vessel_sink.records:
+        if node.get('type') == FISHING_VESSEL:
+            vessel_info[node.get('id')] = {
+                'company': node.get('company', '未知'),
+                'tonnage': node.get('tonnage', '未知'),
+                'length': node.get('length_overall', '未知'),
+                'flag_country': node.get('flag_country', '未知'),
+                'date_added': node.get('_date_added', '未知'),
+                'last_edited_date': node.get('_last_edited_date', '未知'),
+                'raw_source': node.get('_raw_source', '未知')
+            }
+    return vessel_info, ping_sink.columns
+
+
+def write_compact_output(output_file, vessel_info, pings):
+    """紧凑格式输出（route_store.py）：渔船按首次出现的顺序，航点按时间排序"""
+    vessel_ids = pd.unique(pd.Series(pings['target'], dtype=object))
+    vessels = [{'vessel_id': vessel_id, **vessel_info[vessel_id]}
+               for vessel_id in vessel_ids if vessel_id in vessel_info]
+    write_compact_routes(output_file, vessels, pings['target'], pings['source'], pings['time'], pings['dwell'],
+                         pings['latitude'], pings['longitude'])
+    return len(vessels)
+
+
+def vessel_entry(vessel_id, vessel, route):
+    """一艘渔船在 JSON 输出中的条目"""
+    return {
+        'vessel_id': vessel_id,
+        'company': vessel['company'],
+        'tonnage': vessel['tonnage'],
+        'length': vessel['length'],
+        'flag_country': vessel['flag_country'],
+        'date_added': vessel['date_added'],
+        'last_edited_date': vessel['last_edited_date'],
+        'raw_source': vessel['raw_source'],
+        'route_points': len(route),
+        'route': route
+    }
+
+
+def write_json_output(output_file, vessel_info, pings):
+    """JSON 格式输出：每个航点一个字典"""
+    # 提取所有渔船定位事件
+    vessel_routes = defaultdict(list)
+    for time_, location, vessel_id, dwell, lat, lon in zip(
+            pings['time'], pings['source'], pings['target'], pings['dwell'],
+            pings['latitude'], pings['longitude']):
+        if vessel_id in vessel_info:
+            vessel_routes[vessel_id].append({
+                'time': time_,
+                'location': location,
+                'dwell': dwell,
+                'latitude': lat,
+                'longitude': lon
+            })
+    
+    # 按时间对每个渔船的航点进行排序
+    for vessel_id in vessel_routes:
+        vessel_routes[vessel_id].sort(key=lambda x: x['time'])
+    
+    # 准备JSON输出数据
+    output_data = {
+        'total_fishing_vessels': len(vessel_routes),
+        'fishing_vessels': []
+    }
+    
+    for vessel_id, route in vessel_routes.items():
+        output_data['fishing_vessels'].append(vessel_entry(vessel_id, vessel_info[vessel_id], route))
+    
+    # 保存为JSON文件
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(output_data, f, indent=2, ensure_ascii=False)
+    
+    return len(vessel_routes)
+
+
+# ── 分片并行提取 ─────────────────────────────────────────────────────────────
+
+PING_COLUMNS = ('time', 'source', 'target', 'dwell', 'latitude', 'longitude')
+
+
+def _sort_shard(task):
+    """
+    按预先解析的整数时间戳对一个分片排序（渔船内稳定排序）。
+    json 格式直接返回每艘渔船已缩进好的 JSON 片段；npz 格式返回排好序的列
+    """
+    output_format, vessel_info, columns = task
+    times = pd.to_datetime(pd.Series(columns['time'], dtype=object), format='ISO8601', errors='coerce')
+    # 无法解析的时间排在最后
+    time_key = np.where(times.isna(), np.iinfo(np.int64).max, times.to_numpy(dtype='datetime64[ns]').view(np.int64))
+    codes, vessel_ids = pd.factorize(pd.Series(columns['target'], dtype=object))
+    order = np.lexsort((time_key, codes))
+    offsets = np.r_[0, np.cumsum(np.bincount(codes, minlength=len(vessel_ids)))].tolist()
+
+    if output_format == 'json':
+        time_, location, dwell, lat, lon = (columns[name][order].tolist()
+                                           for name in ('time', 'source', 'dwell', 'latitude', 'longitude'))
+        fragments = {}
+        for vessel_id, start, end in zip(vessel_ids, offsets[:-1], offsets[1:]):
+            route = [{'time': t, 'location': loc, 'dwell': d, 'latitude': y, 'longitude': x}
+                     for t, loc, d, y, x in zip(time_[start:end], location[start:end], dwell[start:end],
+                                                lat[start:end], lon[start:end])]
+            text = json.dumps(vessel_entry(vessel_id, vessel_info[vessel_id], route), indent=2, ensure_ascii=False)
+            # 缩进到 "fishing_vessels" 列表内的层级
+            fragments[vessel_id] = '    ' + text.replace('\n', '\n    ')
+        return fragments
+
+    # 紧凑格式不保存时间无法解析的航点（与 write_compact_routes 相同），由主进程统一警告
+    invalid = times.isna().to_numpy()
+    order = order[~invalid[order]]
+    counts = np.bincount(codes[order], minlength=len(vessel_ids))
+    numeric = {name: pd.to_numeric(pd.Series(columns[name], dtype=object), errors='coerce')
+               .to_numpy(dtype=np.float32)[order] for name in ('dwell', 'latitude', 'longitude')}
+    return vessel_ids.tolist(), counts, {'location': columns['source'][order], 'time': time_key[order],
+                                         **numeric}, int(invalid.sum())
+
+
+def extract_sharded(pings, vessel_info, output_file, output_format, workers):
+    """
+    分片并行提取：按渔船 ID 的哈希把定位事件分到 `workers` 个分片，各进程
+    分别排序（json 格式还负责序列化），再按渔船首次出现的顺序合并写出。
+    返回 (渔船数, 各阶段耗时)
+    """
+    timings = {}
+    stage_start = time.time()
+    columns = {name: np.asarray(pings[name], dtype=object) for name in PING_COLUMNS}
+    keep = pd.Series(columns['target']).isin(vessel_info).to_numpy()
+    columns = {name: values[keep] for name, values in columns.items()}
+    vessel_order = pd.unique(pd.Series(columns['target'], dtype=object)).tolist()
+    # 稳定的哈希（不受 PYTHONHASHSEED 影响）
+    shard = pd.util.hash_array(columns['target']) % np.uint64(workers)
+    tasks = []
+    for i in range(workers):
+        rows = np.flatnonzero(shard == i)
+        shard_columns = {name: values[rows] for name, values in columns.items()}
+        shard_info = {vessel_id: vessel_info[vessel_id] for vessel_id in pd.unique(shard_columns['target'])}
+        tasks.append((output_format, shard_info, shard_columns))
+    timings['分片'] = time.time() - stage_start
+
+    stage_start = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_sort_shard, tasks))
+    timings['分片排序' + ('/序列化' if output_format == 'json' else '')] = time.time() - stage_start
+
+    stage_start = time.time()
+    if output_format == 'json':
+        fragments = {}
+        for result in results:
+            fragments.update(result)
+        timings['合并'] = time.time() - stage_start
+        stage_start = time.time()
+        # 与 json.dump(..., indent=2) 的输出逐字节相同
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write('{\n  "total_fishing_vessels": %d,\n  "fishing_vessels": ' % len(vessel_order))
+            if vessel_order:
+                f.write('[\n' + ',\n'.join(fragments[vessel_id] for vessel_id in vessel_order) + '\n  ]')
+            else:
+                f.write('[]')
+            f.write('\n}')
+    else:
+        # 各分片内渔船的航点是连续的：按输出顺序收集这些区段
+        warn_invalid_times(sum(result[3] for result in results))
+        block_start, block_size, base = {}, {}, 0
+        for vessel_ids, counts, _, _ in results:
+            for vessel_id, start, count in zip(vessel_ids, base + np.cumsum(counts) - counts, counts):
+                block_start[vessel_id], block_size[vessel_id] = start, count
+            base += int(np.sum(counts))
+        starts = np.array([block_start[vessel_id] for vessel_id in vessel_order], dtype=np.int64)
+        sizes = np.array([block_size[vessel_id] for vessel_id in vessel_order], dtype=np.int64)
+        offsets = np.r_[0, np.cumsum(sizes)]
+        gather = np.repeat(starts - offsets[:-1], sizes) + np.arange(offsets[-1])
+        merged = {name: np.concatenate([result[2][name] for result in results])[gather]
+                  for name in ('location', 'time', 'dwell', 'latitude', 'longitude')}
+        location, locations = pd.factorize(pd.Series(merged['location'], dtype=object), sort=True)
+        timings['合并'] = time.time() - stage_start
+        stage_start = time.time()
+        vessels = [{'vessel_id': vessel_id, **vessel_info[vessel_id]} for vessel_id in vessel_order]
+        write_sorted_routes(output_file, vessels, offsets, locations, location, merged['time'], merged['dwell'],
+                            merged['latitude'], merged['longitude'])
+    timings['写出'] = time.time() - stage_start
+    return len(vessel_order), timings
+
+
+# ── 增量更新 ─────────────────────────────────────────────────────────────────
+
+def latest_route_time(routes_file):
+    """已有航线文件中最晚的航点时间（高水位）"""
+    if routes_file.endswith('.npz'):
+        times = CompactRoutes(routes_file)._all_times()
+        return pd.Timestamp(times.max()) if len(times) else None
+    with open(routes_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    times = pd.to_datetime(pd.Series([point['time'] for vessel in data['fishing_vessels'] for point in vessel['route']],
+                                     dtype=object), format='ISO8601', errors='coerce')
+    return times.max() if times.notna().any() else None
+
+
+def merge_json_routes(routes_file, vessel_info, pings):
+    """
+    把新的定位事件合并进已有的 JSON 航线文件（原地更新）：每艘渔船的新航点
+    按时间排序后与原航线归并（已有的航点不重复加入），`vessel_info` 中的
+    渔船更新元数据。
+    返回 (新增航点数, 涉及渔船数)
+    """
+    with open(routes_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    entries = {vessel['vessel_id']: vessel for vessel in data['fishing_vessels']}
+
+    new_routes = defaultdict(list)
+    for time_, location, vessel_id, dwell, lat, lon in zip(
+            pings['time'], pings['source'], pings['target'], pings['dwell'],
+            pings['latitude'], pings['longitude']):
+        if vessel_id in vessel_info or vessel_id in entries:
+            new_routes[vessel_id].append({
+                'time': time_,
+                'location': location,
+                'dwell': dwell,
+                'latitude': lat,
+                'longitude': lon
+            })
+
+    for vessel_id in list(new_routes):
+        route = new_routes[vessel_id]
+        if vessel_id in entries:
+            # 跳过文件中已有的航点（渔船、时间、地点都相同），重叠的更新不会重复写入
+            old_route = entries[vessel_id]['route']
+            old_times, _ = parse_route_times([point['time'] for point in old_route])
+            new_times, _ = parse_route_times([point['time'] for point in route])
+            stored = set(zip(old_times.tolist(), (point['location'] for point in old_route)))
+            route = [point for point, t in zip(route, new_times.tolist())
+                     if (t, point['location']) not in stored]
+            if not route:
+                del new_routes[vessel_id]
+                continue
+            new_routes[vessel_id] = route
+        route.sort(key=lambda x: x['time'])
+        if vessel_id in entries:
+            # 归并两条已排序的航线；时间相同时原有航点在前
+            entry = entries[vessel_id]
+            entry['route'] = list(heapq.merge(entry['route'], route, key=lambda x: x['time']))
+            entry['route_points'] = len(entry['route'])
+        else:
+            entries[vessel_id] = vessel_entry(vessel_id, vessel_info[vessel_id], route)
+            data['fishing_vessels'].append(entries[vessel_id])
+
+    # 更新渔船元数据（last_edited_date 等）
+    for vessel_id, vessel in vessel_info.items():
+        if vessel_id in entries:
+            metadata = vessel_entry(vessel_id, vessel, [])
+            entries[vessel_id].update({key: value for key, value in metadata.items()
+                                       if key not in ('route_points', 'route')})
+    data['total_fishing_vessels'] = len(data['fishing_vessels'])
+
+    with open(routes_file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(routes_file + '.tmp', routes_file)
+    return sum(len(route) for route in new_routes.values()), len(new_routes)
+
+
+def update_vessel_routes(routes_file, delta_file=None, since=None):
+    """
+    增量更新已有的航线文件（.json 或 .npz）。新的定位事件来自 `delta_file`
+    （只含新节点 / 新连接的图文件），或来自 MC2/mc2.json 中晚于高水位
+    `since` 的部分（默认取文件中最晚的航点时间）。
+    """
+    print(f"开始增量更新渔船航线数据: {routes_file}")
+    start_time = time.time()
+
+    try:
+        if delta_file is None and since is None:
+            since = latest_route_time(routes_file)
+            print(f"高水位: {since}")
+        vessel_info, pings = read_vessel_pings(delta_file or DATA_FILE)
+        # 时间无法解析的定位事件无法与高水位比较、也无法写入紧凑格式：
+        # 两种输入方式、两种格式都跳过它们并给出警告
+        times, keep = parse_route_times(pings['time'])
+        if not keep.all():
+            print(f"警告: 跳过 {int((~keep).sum())} 个时间无法解析的定位事件")
+        if since is not None:
+            keep &= times > pd.Timestamp(since).value
+        pings = {name: np.asarray(values, dtype=object)[keep] for name, values in pings.items()}
+        read_time = time.time() - start_time
+
+        if routes_file.endswith('.npz'):
+            vessels = [{'vessel_id': vessel_id, **vessel} for vessel_id, vessel in vessel_info.items()]
+            added, touched = merge_compact_routes(routes_file, vessels, pings['target'], pings['source'],
+                                                  pings['time'], pings['dwell'], pings['latitude'],
+                                                  pings['longitude'])
+        else:
+            added, touched = merge_json_routes(routes_file, vessel_info, pings)
+
+        print(f"\n读取新数据耗时: {read_time:.2f}秒")
+        print(f"\n新增 {added} 个航点，涉及 {touched} 艘渔船，已更新 {routes_file}")
+
+    except Exception as e:
+        print(f"处理过程中出错: {e}")
+
+    elapsed_time = time.time() - start_time
+    print(f"\n处理完成，耗时: {elapsed_time:.2f}秒")
+
+
+def extract_vessel_routes(output_format='json', workers=1):
     print("开始提取渔船航线数据...")
     start_time = time.time()
     
     try:
-        # 读取JSON文件
-        with open('MC2/mc2.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # 创建渔船ID到渔船信息的映射
-        vessel_info = {}
-        for node in data.get('nodes', []):
-            if node.get('type') == 'Entity.Vessel.FishingVessel':
-                vessel_info[node.get('id')] = {
-                    'company': node.get('company', '未知'),
-                    'tonnage': node.get('tonnage', '未知'),
-                    'length': node.get('length_overall', '未知'),
-                    'flag_country': node.get('flag_country', '未知'),
-                    'date_added': node.get('_date_added', '未知'),
-                    'last_edited_date': node.get('_last_edited_date', '未知'),
-                    'raw_source': node.get('_raw_source', '未知')
-                }
-        
-        # 提取所有渔船定位事件
-        vessel_routes = defaultdict(list)
-        for link in data.get('links', []):
-            if link.get('type') == 'Event.TransportEvent.TransponderPing':
-                vessel_id = link.get('target')
-                if vessel_id in vessel_info:
-                    vessel_routes[vessel_id].append({
-                        'time': link.get('time'),
-                        'location': link.get('source'),
-                        'dwell': link.get('dwell'),
-                        'latitude': link.get('latitude', '未知'),
-                        'longitude': link.get('longitude', '未知')
-                    })
-        
-        # 按时间对每个渔船的航点进行排序
-        for vessel_id in vessel_routes:
-            vessel_routes[vessel_id].sort(key=lambda x: x['time'])
-        
-        # 保存到文件
+        vessel_info, pings = read_vessel_pings()
+        read_time = time.time() - start_time
+
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_file = f'fishing_vessel_routes_{timestamp}.json'
-        
-        # 准备JSON输出数据
-        output_data = {
-            'total_fishing_vessels': len(vessel_routes),
-            'fishing_vessels': []
-        }
-        
-        for vessel_id, route in vessel_routes.items():
-            vessel = vessel_info[vessel_id]
-            vessel_data = {
-                'vessel_id': vessel_id,
-                'company': vessel['company'],
-                'tonnage': vessel['tonnage'],
-                'length': vessel['length'],
-                'flag_country': vessel['flag_country'],
-                'date_added': vessel['date_added'],
-                'last_edited_date': vessel['last_edited_date'],
-                'raw_source': vessel['raw_source'],
-                'route_points': len(route),
-                'route': route
-            }
-            output_data['fishing_vessels'].append(vessel_data)
-        
-        # 保存为JSON文件
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, indent=2, ensure_ascii=False)
-        
+        output_file = f'fishing_vessel_routes_{timestamp}.{output_format}'
+        if workers > 1:
+            total, timings = extract_sharded(pings, vessel_info, output_file, output_format, workers)
+            print(f"\n各阶段耗时（{workers} 个进程）:")
+            for stage, seconds in {'读取': read_time, **timings}.items():
+                print(f"  {stage}: {seconds:.2f}秒")
+        elif output_format == 'npz':
+            total = write_compact_output(output_file, vessel_info, pings)
+        else:
+            total = write_json_output(output_file, vessel_info, pings)
+
         print(f"\n渔船航线信息已保存至 {output_file}")
-        print(f"\n总共找到 {len(vessel_routes)} 艘渔船")
+        print(f"\n总共找到 {total} 艘渔船")
         
     except Exception as e:
         print(f"处理过程中出错: {e}")
@@ -84,4 +360,22 @@ def extract_vessel_routes():
     print(f"\n处理完成，耗时: {elapsed_time:.2f}秒")
 
 if __name__ == "__main__":
-    extract_vessel_routes()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Extract fishing vessel routes from MC2/mc2.json')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='json',
+                        help='json: fishing_vessel_routes_<ts>.json; npz: compact route file (route_store.py)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='>1: shard the pings by vessel over this many processes and report stage timings')
+    parser.add_argument('--update', metavar='ROUTES_FILE',
+                        help='merge new pings into this existing .json / .npz routes file instead of writing a new one')
+    parser.add_argument('--delta', metavar='GRAPH_JSON',
+                        help='with --update: graph file holding only the new nodes / links')
+    parser.add_argument('--since', metavar='TIME',
+                        help='with --update: only pings after this time (default without --delta: the latest '
+                             'time already in ROUTES_FILE)')
+    args = parser.parse_args()
+    if (args.delta or args.since) and not args.update:
+        parser.error('--delta / --since need --update')
+    if args.update:
+        update_vessel_routes(args.update, args.delta, args.since)
+    else:
+        extract_vessel_routes(args.format, args.workers)
\ No newline at end of file
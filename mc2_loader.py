@@ -0,0 +1,117 @@
+"""
+Streaming loader for the MC2 knowledge graph (MC2/mc2.json).
+
+The graph is read in a single pass: every record of the top-level `nodes`
+and `links` arrays is built one at a time and handed to the sinks whose
+type prefix matches the record's `type`, so only the records a script
+actually keeps stay in memory.
+"""
+
+import json
+
+try:
+    import ijson
+    from ijson.common import ObjectBuilder
+except ImportError:  # fall back to json.load when ijson is not installed
+    ijson = None
+
+# Node / link types used across the scripts
+FISHING_VESSEL = 'Entity.Vessel.FishingVessel'
+VESSEL = 'Entity.Vessel'
+LOCATION = 'Entity.Location'
+TRANSPONDER_PING = 'Event.TransportEvent.TransponderPing'
+
+SECTIONS = ('nodes', 'links')
+
+
+class RecordSink:
+    """Keep matching records as dicts (optionally only the given fields)"""
+
+    def __init__(self, fields=None):
+        self.fields = fields
+        self.records = []
+
+    def add(self, record):
+        if self.fields is not None:
+            record = {field: record.get(field) for field in self.fields}
+        self.records.append(record)
+
+    def __len__(self):
+        return len(self.records)
+
+
+class ColumnSink:
+    """Keep matching records column by column (one list per field)"""
+
+    def __init__(self, fields, defaults=None):
+        self.fields = tuple(fields)
+        self.defaults = defaults or {}
+        self.columns = {field: [] for field in self.fields}
+
+    def add(self, record):
+        for field in self.fields:
+            self.columns[field].append(record.get(field, self.defaults.get(field)))
+
+    def __len__(self):
+        return len(self.columns[self.fields[0]])
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame(self.columns, columns=list(self.fields))
+
+
+class PingSink(ColumnSink):
+    """Column store for TransponderPing links"""
+
+    FIELDS = ('source', 'target', 'time', 'dwell')
+
+    def __init__(self, extra_fields=(), defaults=None):
+        super().__init__(self.FIELDS + tuple(extra_fields), defaults)
+
+
+def iter_graph(file_path):
+    """Yield (section, record) for every node and link, in file order"""
+    if ijson is None:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for section in SECTIONS:
+            for record in data.get(section, []):
+                yield section, record
+        return
+
+    item_prefixes = {f'{section}.item': section for section in SECTIONS}
+    with open(file_path, 'rb') as f:
+        builder, item_prefix = None, None
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if builder is None:
+                if event == 'start_map' and prefix in item_prefixes:
+                    builder, item_prefix = ObjectBuilder(), prefix
+                    builder.event(event, value)
+                continue
+            builder.event(event, value)
+            if event == 'end_map' and prefix == item_prefix:
+                yield item_prefixes[item_prefix], builder.value
+                builder, item_prefix = None, None
+
+
+def _match(sinks, record):
+    record_type = str(record.get('type', '')).strip()
+    return [sink for prefix, sink in sinks.items() if record_type.startswith(prefix)]
+
+
+def load_mc2(file_path, node_sinks=None, link_sinks=None):
+    """
+    Stream the graph into sinks.
+
+    `node_sinks` / `link_sinks` map a type prefix (e.g. FISHING_VESSEL,
+    TRANSPONDER_PING, or '' for everything) to an object with an `add`
+    method. Records that match no sink are dropped as soon as they are read.
+    Returns the number of nodes and links read.
+    """
+    sinks = {'nodes': node_sinks or {}, 'links': link_sinks or {}}
+    counts = {section: 0 for section in SECTIONS}
+    for section, record in iter_graph(file_path):
+        counts[section] += 1
+        for sink in _match(sinks[section], record):
+            sink.add(record)
+    return counts['nodes'], counts['links']
@@ -0,0 +1,326 @@
+"""
+Columnar on-disk store for the MC2 TransponderPing table.
+
+`build_store` streams MC2/mc2.json once (through mc2_loader) and writes
+
+    mc2_store/pings.parquet      vessel_id, location_id (categorical),
+                                 time (int64 ns since epoch), dwell (float64),
+                                 sorted by vessel and then time
+    mc2_store/ping_offsets.parquet  vessel_id, start, end: each vessel's
+                                 row range in pings.parquet
+    mc2_store/vessels.parquet    vessel node metadata
+    mc2_store/locations.parquet  location node metadata
+    mc2_store/meta.json          size / mtime of the source JSON
+
+The `load_*` readers rebuild the store automatically when the source JSON
+has changed, so scripts can call them unconditionally. `load_pings` can
+prune at read time to a set of vessels, a set of locations and a
+[start, end) time window: vessel row ranges come from the offsets, the
+window is binary-searched inside each range on the time column, and only
+the Parquet row groups those rows fall in are read.
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from mc2_loader import FISHING_VESSEL, LOCATION, TRANSPONDER_PING, VESSEL, PingSink, RecordSink, load_mc2
+
+DATA_FILE = 'MC2/mc2.json'
+STORE_DIR = 'mc2_store'
+
+PINGS_FILE = 'pings.parquet'
+PING_OFFSETS_FILE = 'ping_offsets.parquet'
+VESSELS_FILE = 'vessels.parquet'
+LOCATIONS_FILE = 'locations.parquet'
+META_FILE = 'meta.json'
+
+# Bumped whenever the files written by build_store change, so older stores get rebuilt
+STORE_LAYOUT = 3
+# Rows per Parquet row group of pings.parquet, the unit a filtered read skips
+PINGS_ROW_GROUP = 16384
+
+VESSEL_FIELDS = ('id', 'type', 'company', 'tonnage', 'length_overall', 'flag_country',
+                 '_date_added', '_last_edited_date', '_raw_source')
+LOCATION_FIELDS = ('id', 'type', 'kind', 'Name')
+
+
+def _source_signature(json_path):
+    stat = os.stat(json_path)
+    return {'source': os.path.abspath(json_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'layout': STORE_LAYOUT}
+
+
+def _metadata_frame(records, fields):
+    df = pd.DataFrame(records, columns=list(fields))
+    # Parquet needs one type per column; keep numbers numeric and everything else as text
+    for col in df.columns:
+        if df[col].dtype == object:
+            numeric = pd.to_numeric(df[col], errors='coerce')
+            if numeric.notna().sum() == df[col].notna().sum():
+                df[col] = numeric
+            else:
+                df[col] = df[col].map(lambda v: v if v is None or isinstance(v, str) else str(v))
+    return df
+
+
+def resolve_ping_orientation(source, target, vessel_ids):
+    """
+    Return (vessel_id, location_id, keep_mask) for ping endpoints.
+
+    A ping is kept when exactly one endpoint is a vessel; that endpoint is
+    the vessel and the other one the location.
+    """
+    source = pd.Series(source, dtype=object)
+    target = pd.Series(target, dtype=object)
+    source_is_vessel = source.isin(vessel_ids).to_numpy()
+    target_is_vessel = target.isin(vessel_ids).to_numpy()
+    keep = source_is_vessel != target_is_vessel
+    vessel_id = np.where(source_is_vessel, source, target)
+    location_id = np.where(source_is_vessel, target, source)
+    return vessel_id[keep], location_id[keep], keep
+
+
+def write_pings(pings, store_dir=STORE_DIR):
+    """
+    Write a ping table (vessel_id categorical) as pings.parquet, vessel by
+    vessel in time order, plus each vessel's row range
+    """
+    # Stable sort, so pings with equal times keep their order
+    codes = pings['vessel_id'].cat.codes.to_numpy()
+    order = np.lexsort((pings['time'].to_numpy(), codes))
+    pings = pings.iloc[order].reset_index(drop=True)
+    counts = np.bincount(codes, minlength=len(pings['vessel_id'].cat.categories))
+    ends = np.cumsum(counts)
+    offsets = pd.DataFrame({'vessel_id': pings['vessel_id'].cat.categories.astype(object),
+                            'start': ends - counts, 'end': ends})
+    pings.to_parquet(os.path.join(store_dir, PINGS_FILE), index=False, row_group_size=PINGS_ROW_GROUP)
+    offsets.to_parquet(os.path.join(store_dir, PING_OFFSETS_FILE), index=False)
+
+
+def build_store(json_path=DATA_FILE, store_dir=STORE_DIR):
+    """Parse the graph once and write the columnar store"""
+    print(f"Building ping store from {json_path}...")
+    start_time = time.time()
+
+    vessel_sink = RecordSink(fields=VESSEL_FIELDS)
+    location_sink = RecordSink(fields=LOCATION_FIELDS)
+    ping_sink = PingSink()
+    load_mc2(json_path,
+             node_sinks={VESSEL: vessel_sink, LOCATION: location_sink},
+             link_sinks={TRANSPONDER_PING: ping_sink})
+
+    vessels = _metadata_frame(vessel_sink.records, VESSEL_FIELDS)
+    locations = _metadata_frame(location_sink.records, LOCATION_FIELDS)
+
+    pings = ping_sink.columns
+    vessel_id, location_id, keep = resolve_ping_orientation(
+        pings['source'], pings['target'], set(vessels['id']))
+    times = pd.to_datetime(pd.Series(pings['time'], dtype=object)[keep],
+                           format='ISO8601', errors='coerce')
+    dwell = pd.to_numeric(pd.Series(pings['dwell'], dtype=object)[keep], errors='coerce')
+    pings_df = pd.DataFrame({
+        'vessel_id': pd.Categorical(vessel_id),
+        'location_id': pd.Categorical(location_id),
+        'time': times.to_numpy(dtype='datetime64[ns]').astype(np.int64),
+        'dwell': dwell.to_numpy(dtype=np.float64),
+    })
+
+    os.makedirs(store_dir, exist_ok=True)
+    write_pings(pings_df, store_dir)
+    vessels.to_parquet(os.path.join(store_dir, VESSELS_FILE), index=False)
+    locations.to_parquet(os.path.join(store_dir, LOCATIONS_FILE), index=False)
+    with open(os.path.join(store_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(_source_signature(json_path), f, indent=2)
+
+    print(f"Stored {len(pings_df):,} pings, {len(vessels):,} vessels, {len(locations):,} locations "
+          f"in {store_dir} ({time.time() - start_time:.2f}s)")
+
+
+def store_is_fresh(json_path=DATA_FILE, store_dir=STORE_DIR):
+    """True when the store exists and was built from the current source JSON"""
+    meta_path = os.path.join(store_dir, META_FILE)
+    if not os.path.exists(meta_path):
+        return False
+    if not os.path.exists(json_path):
+        return True  # nothing to rebuild from, use what we have
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    return meta == _source_signature(json_path)
+
+
+def ensure_store(json_path=DATA_FILE, store_dir=STORE_DIR):
+    if not store_is_fresh(json_path, store_dir):
+        build_store(json_path, store_dir)
+    return store_dir
+
+
+def _time_ns(value):
+    return None if value is None else pd.Timestamp(value).value
+
+
+def _read_row_ranges(parquet_file, lo, hi, columns):
+    """
+    Rows lo[i]:hi[i] of a Parquet file, range after range, reading only the
+    row groups the ranges overlap
+    """
+    sizes = np.array([parquet_file.metadata.row_group(g).num_rows
+                      for g in range(parquet_file.num_row_groups)], dtype=np.int64)
+    group_start = np.r_[0, np.cumsum(sizes)]
+    nonempty = hi > lo
+    lo, hi = lo[nonempty], hi[nonempty]
+    first = np.searchsorted(group_start, lo, side='right') - 1
+    last = np.searchsorted(group_start, hi, side='left') - 1
+    # Every group from first to last of some range
+    marks = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.add.at(marks, first, 1)
+    np.add.at(marks, last + 1, -1)
+    groups = np.flatnonzero(np.cumsum(marks)[:-1] > 0)
+    table = parquet_file.read_row_groups(groups.tolist(), columns=columns, use_pandas_metadata=True)
+
+    # File row r of group g is row r - group_start[g] + table_start[g] of the table
+    table_start = np.zeros(len(sizes), dtype=np.int64)
+    table_start[groups] = np.cumsum(sizes[groups]) - sizes[groups]
+    counts = hi - lo
+    out_start = np.cumsum(counts) - counts
+    rows = np.arange(counts.sum()) + np.repeat(lo - group_start[first] + table_start[first] - out_start, counts)
+    return table.take(rows).to_pandas()
+
+
+def load_pings(json_path=DATA_FILE, store_dir=STORE_DIR, columns=None, vessel_ids=None, locations=None,
+               start=None, end=None):
+    """
+    Ping table: vessel_id, location_id, time (int64 ns), dwell (float64),
+    vessel by vessel in time order.
+
+    `vessel_ids` / `locations` restrict it to those vessels / locations and
+    `start` / `end` (anything pd.Timestamp accepts) to pings with
+    start <= time < end; only the matching part of the store is read.
+    """
+    ensure_store(json_path, store_dir)
+    path = os.path.join(store_dir, PINGS_FILE)
+    if vessel_ids is None and locations is None and start is None and end is None:
+        return pd.read_parquet(path, columns=columns)
+
+    offsets = pd.read_parquet(os.path.join(store_dir, PING_OFFSETS_FILE))
+    if vessel_ids is not None:
+        offsets = offsets[offsets['vessel_id'].isin(list(vessel_ids))]
+    lo, hi = offsets['start'].to_numpy(), offsets['end'].to_numpy()
+    parquet_file = pq.ParquetFile(path)
+    if start is not None or end is not None:
+        # Narrow each vessel's range to the window by binary search on its times
+        times = _read_row_ranges(parquet_file, lo, hi, ['time'])['time'].to_numpy()
+        first, stop = _time_ns(start), _time_ns(end)
+        bounds = np.r_[0, np.cumsum(hi - lo)]
+        window_lo, window_hi = lo.copy(), hi.copy()
+        for i, (a, b) in enumerate(zip(bounds[:-1].tolist(), bounds[1:].tolist())):
+            if first is not None:
+                window_lo[i] = lo[i] + np.searchsorted(times[a:b], first)
+            if stop is not None:
+                window_hi[i] = lo[i] + np.searchsorted(times[a:b], stop)
+        lo, hi = window_lo, window_hi
+
+    read_columns = columns
+    if columns is not None and locations is not None and 'location_id' not in columns:
+        read_columns = list(columns) + ['location_id']
+    pings = _read_row_ranges(parquet_file, lo, hi, read_columns)
+    if locations is not None:
+        pings = pings[pings['location_id'].isin(list(locations))].reset_index(drop=True)
+    return pings if columns is None else pings[list(columns)]
+
+
+def load_vessels(json_path=DATA_FILE, store_dir=STORE_DIR, vessel_type=None):
+    """Vessel metadata, optionally restricted to one node type"""
+    ensure_store(json_path, store_dir)
+    vessels = pd.read_parquet(os.path.join(store_dir, VESSELS_FILE))
+    if vessel_type is not None:
+        vessels = vessels[vessels['type'] == vessel_type].reset_index(drop=True)
+    return vessels
+
+
+def load_locations(json_path=DATA_FILE, store_dir=STORE_DIR):
+    ensure_store(json_path, store_dir)
+    return pd.read_parquet(os.path.join(store_dir, LOCATIONS_FILE))
+
+
+class VesselPingIndex:
+    """
+    Pings partitioned by vessel and sorted by time, built with one sort.
+
+    Each vessel's pings are a contiguous row range of `pings`, so `vessel`
+    returns a slice instead of rescanning the whole table.
+    """
+
+    def __init__(self, pings):
+        vessel_codes = pd.Categorical(pings['vessel_id'])
+        codes = vessel_codes.codes
+        order = np.lexsort((pings['time'].to_numpy(), codes))
+        self.pings = pings.iloc[order].reset_index(drop=True)
+        codes = codes[order]
+        bounds = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+        starts = np.r_[0, bounds] if len(codes) else np.array([], dtype=int)
+        ends = np.r_[bounds, len(codes)] if len(codes) else np.array([], dtype=int)
+        self.offsets = {vessel_codes.categories[code]: (int(start), int(end))
+                        for code, start, end in zip(codes[starts], starts, ends) if code >= 0}
+
+    def __contains__(self, vessel_id):
+        return vessel_id in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def vessel_ids(self):
+        return list(self.offsets)
+
+    def vessel(self, vessel_id):
+        """Time-sorted pings of one vessel (empty frame when it has none)"""
+        start, end = self.offsets.get(vessel_id, (0, 0))
+        return self.pings.iloc[start:end]
+
+
+def load_ping_index(json_path=DATA_FILE, store_dir=STORE_DIR, vessel_ids=None, locations=None, start=None,
+                    end=None):
+    """VesselPingIndex of the pings, with the load_pings filters"""
+    return VesselPingIndex(load_pings(json_path, store_dir, vessel_ids=vessel_ids, locations=locations,
+                                      start=start, end=end))
+
+
+def load_fishing_routes(json_path=DATA_FILE, store_dir=STORE_DIR):
+    """
+    Fishing vessel routes in the layout of fishing_vessel_routes.json
+    (time-sorted route points with time, location and dwell)
+    """
+    vessels = load_vessels(json_path, store_dir, vessel_type=FISHING_VESSEL).set_index('id')
+    pings = load_pings(json_path, store_dir)
+    index = VesselPingIndex(pings[pings['vessel_id'].isin(vessels.index)])
+    pings = index.pings
+    times = pd.to_datetime(pings['time']).dt.strftime('%Y-%m-%dT%H:%M:%S.%f').to_numpy()
+    locations = pings['location_id'].astype(object).to_numpy()
+    dwells = pings['dwell'].astype(float).to_numpy()
+
+    fishing_vessels = []
+    for vessel_id, (start, end) in index.offsets.items():
+        vessel = vessels.loc[vessel_id]
+        route = [{'time': t, 'location': loc, 'dwell': d}
+                 for t, loc, d in zip(times[start:end], locations[start:end], dwells[start:end])]
+        fishing_vessels.append({
+            'vessel_id': vessel_id,
+            'company': vessel['company'],
+            'tonnage': vessel['tonnage'],
+            'length': vessel['length_overall'],
+            'flag_country': vessel['flag_country'],
+            'date_added': vessel['_date_added'],
+            'last_edited_date': vessel['_last_edited_date'],
+            'raw_source': vessel['_raw_source'],
+            'route_points': len(route),
+            'route': route
+        })
+    return {'total_fishing_vessels': len(fishing_vessels), 'fishing_vessels': fishing_vessels}
+
+
+if __name__ == "__main__":
+    build_store()
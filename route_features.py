@@ -0,0 +1,156 @@
+"""
+Flat route tables and the per-vessel features computed on them
+(vessel_similarity.py, vessel_parallel_coordinates.py).
+
+A RouteTable keeps every route point of every vessel in four typed
+arrays (vessel code, location code, epoch time in ns, dwell), vessel by
+vessel in time order, with `offsets` marking each vessel's rows. Features
+are grouped NumPy reductions over those arrays instead of Python loops
+over route dicts.
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from mc2_loader import FISHING_VESSEL
+from ping_store import DATA_FILE, STORE_DIR, VesselPingIndex, load_pings, load_vessels
+
+# Per-vessel route features, in the column order vessel_similarity.py uses
+ROUTE_STAT_COLUMNS = ['num_locations', 'avg_dwell', 'std_dwell', 'max_dwell', 'min_dwell', 'avg_time', 'std_time']
+
+
+class RouteTable:
+    """
+    Route points of many vessels as parallel arrays.
+
+    Rows offsets[i]:offsets[i + 1] are the time-sorted points of vessel
+    vessel_ids[i]; `vessel` and `location` are codes into `vessel_ids`
+    and `locations`. The from_* constructors drop points without a valid
+    time (with a warning), so every time is a real epoch.
+    """
+
+    def __init__(self, vessel_ids, locations, vessel, location, time, dwell):
+        self.vessel_ids = np.asarray(vessel_ids, dtype=object)
+        self.locations = np.asarray(locations, dtype=object)
+        self.vessel = np.asarray(vessel, dtype=np.int32)
+        self.location = np.asarray(location, dtype=np.int32)
+        self.time = np.asarray(time, dtype=np.int64)
+        self.dwell = np.asarray(dwell, dtype=np.float64)
+        counts = np.bincount(self.vessel, minlength=len(self.vessel_ids))
+        self.offsets = np.r_[0, np.cumsum(counts)]
+
+    def __len__(self):
+        return len(self.time)
+
+    @classmethod
+    def from_routes(cls, fishing_vessels):
+        """Table of routes in the layout of fishing_vessel_routes.json (points already time-sorted)"""
+        vessel_ids = [vessel['vessel_id'] for vessel in fishing_vessels]
+        sizes = [len(vessel['route']) for vessel in fishing_vessels]
+        points = [point for vessel in fishing_vessels for point in vessel['route']]
+        location, locations = pd.factorize(pd.Series([point['location'] for point in points], dtype=object),
+                                           sort=True)
+        time, valid = parse_route_times([point['time'] for point in points])
+        warn_invalid_times(int((~valid).sum()))
+        vessel = np.repeat(np.arange(len(vessel_ids)), sizes)
+        dwell = np.fromiter((point['dwell'] for point in points), dtype=np.float64, count=len(points))
+        return cls(vessel_ids, locations, vessel[valid], location[valid], time[valid], dwell[valid])
+
+    @classmethod
+    def from_pings(cls, pings):
+        """Table of a ping_store ping table, vessels in VesselPingIndex order"""
+        index = VesselPingIndex(pings)
+        pings = index.pings
+        vessel_ids = list(index.offsets)
+        vessel = np.repeat(np.arange(len(vessel_ids)), [end - start for start, end in index.offsets.values()])
+        location, locations = pd.factorize(pings['location_id'].astype(object), sort=True)
+        time = pings['time'].to_numpy()
+        valid = ~np.isnat(time.view('datetime64[ns]'))
+        warn_invalid_times(int((~valid).sum()))
+        return cls(vessel_ids, locations, vessel[valid], location[valid], time[valid],
+                   pings['dwell'].astype(float).to_numpy()[valid])
+
+    def to_frame(self):
+        """vessel_id / location / time (hour of day) / dwell rows"""
+        return pd.DataFrame({'vessel_id': self.vessel_ids[self.vessel],
+                             'location': self.locations[self.location],
+                             'time': hour_of_day(self.time),
+                             'dwell': self.dwell})
+
+
+def load_route_table(json_path=DATA_FILE, store_dir=STORE_DIR, vessel_ids=None, locations=None, start=None,
+                     end=None):
+    """
+    RouteTable of the fishing vessels, in load_fishing_routes order,
+    optionally only `vessel_ids`, `locations` and start <= time < end
+    (pruned while reading, see ping_store.load_pings)
+    """
+    fishing = load_vessels(json_path, store_dir, vessel_type=FISHING_VESSEL)['id']
+    if vessel_ids is not None:
+        fishing = fishing[fishing.isin(list(vessel_ids))]
+    return RouteTable.from_pings(load_pings(json_path, store_dir, vessel_ids=fishing, locations=locations,
+                                            start=start, end=end))
+
+
+def parse_route_times(time):
+    """Epoch ns of ISO-string / datetime times, and the mask of those that parse"""
+    times = pd.to_datetime(pd.Series(time, dtype=object), format='ISO8601', errors='coerce')
+    return times.to_numpy(dtype='datetime64[ns]').view(np.int64), times.notna().to_numpy()
+
+
+def warn_invalid_times(count):
+    """Warn that `count` route points were left out for an unparseable time"""
+    if count:
+        warnings.warn(f"skipped {count} route point(s) without a valid time", stacklevel=3)
+
+
+def hour_of_day(time):
+    """Hour of day of epoch-ns times, with whole seconds (fractions dropped)"""
+    seconds = (np.asarray(time, dtype=np.int64) // 10**9) % 86400
+    return seconds // 3600 + (seconds % 3600 // 60) / 60 + (seconds % 60) / 3600
+
+
+def _segment_sums(values, offsets):
+    # np.add.reduce over each vessel's slice sums pairwise, exactly as
+    # np.mean / np.std do on a vessel's list (np.add.reduceat sums
+    # sequentially and differs in the last bits); the loop is per vessel,
+    # not per point
+    return np.array([values[lo:hi].sum() for lo, hi in zip(offsets[:-1].tolist(), offsets[1:].tolist())])
+
+
+def _group_mean_std(values, offsets, counts):
+    nonempty = counts > 0
+    mean, std = np.zeros(len(counts)), np.zeros(len(counts))
+    mean[nonempty] = _segment_sums(values, offsets)[nonempty] / counts[nonempty]
+    deviation = values - np.repeat(mean, counts)
+    std[nonempty] = np.sqrt(_segment_sums(deviation * deviation, offsets)[nonempty] / counts[nonempty])
+    return mean, std
+
+
+def vessel_route_stats(table):
+    """
+    Per-vessel ROUTE_STAT_COLUMNS, indexed by vessel id: distinct locations,
+    dwell mean / std / max / min and mean / std of the hour of day (all 0
+    for an empty route)
+    """
+    counts = np.diff(table.offsets)
+    nonempty = counts > 0
+    starts = table.offsets[:-1][nonempty]
+
+    # Distinct (vessel, location) pairs
+    pairs = np.unique(table.vessel.astype(np.int64) * max(len(table.locations), 1) + table.location)
+    num_locations = np.bincount(pairs // max(len(table.locations), 1), minlength=len(counts))
+
+    avg_dwell, std_dwell = _group_mean_std(table.dwell, table.offsets, counts)
+    avg_time, std_time = _group_mean_std(hour_of_day(table.time), table.offsets, counts)
+    max_dwell, min_dwell = np.zeros(len(counts)), np.zeros(len(counts))
+    if len(starts):
+        max_dwell[nonempty] = np.maximum.reduceat(table.dwell, starts)
+        min_dwell[nonempty] = np.minimum.reduceat(table.dwell, starts)
+
+    return pd.DataFrame({'num_locations': num_locations, 'avg_dwell': avg_dwell, 'std_dwell': std_dwell,
+                         'max_dwell': max_dwell, 'min_dwell': min_dwell,
+                         'avg_time': avg_time, 'std_time': std_time},
+                        index=pd.Index(table.vessel_ids, name='vessel_id'))
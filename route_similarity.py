@@ -0,0 +1,564 @@
+"""
+Route similarity measures used by vessel_similarity.py.
+
+Sequence similarity is the longest common subsequence (LCS) of two
+location sequences divided by the longer length. `lcs_length` uses the
+bit-parallel algorithm of Hyyrö (2004) on Python integers: one bit per
+position of the first sequence, one add / and / or / sub per element of
+the second, so memory is linear and the inner loop runs in C.
+
+`protected_similarity_matrix` computes all pairs of
+`calculate_protected_similarity` in square tiles of the upper triangle,
+spread over a process pool and checkpointed tile by tile. The similarity
+cache keeps per-route features and pair similarities across runs, keyed
+by a hash of each route.
+
+For fleets too large for all pairs, `RouteLSHIndex` finds candidate
+similar vessels with MinHash signatures of each route's protected-area
+shingles and LSH banding; `protected_similarity_pairs` then computes the
+exact similarity of the candidate pairs only, without any n x n matrix.
+"""
+
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+from itertools import chain
+import json
+import os
+import pickle
+
+import numpy as np
+
+# Define protected areas
+PROTECTED_AREAS = ['Don Limpet Preserve', 'Ghoti Preserve', 'Nemo Reef']
+
+
+def get_location_sequence_features(route):
+    """Calculate location sequence features"""
+    # Initialize features
+    features = {
+        'sequence': [],  # Location sequence
+        'protected_visits': [],  # Protected area visit sequence
+        'before_protected': defaultdict(list),  # Sequence before protected areas
+        'after_protected': defaultdict(list),  # Sequence after protected areas
+        'protected_transitions': defaultdict(int)  # Transitions between protected areas
+    }
+
+    # Record location sequence
+    for point in route:
+        location = point['location']
+        features['sequence'].append(location)
+        if location in PROTECTED_AREAS:
+            features['protected_visits'].append(location)
+
+    # Analyze sequences before and after protected areas
+    for i, location in enumerate(features['sequence']):
+        if location in PROTECTED_AREAS:
+            # Record two locations before protected area
+            if i >= 2:
+                prev_locs = features['sequence'][i-2:i]
+                if not any(loc in PROTECTED_AREAS for loc in prev_locs):
+                    features['before_protected'][location].extend(prev_locs)
+
+            # Record two locations after protected area
+            if i < len(features['sequence'])-2:
+                next_locs = features['sequence'][i+1:i+3]
+                if not any(loc in PROTECTED_AREAS for loc in next_locs):
+                    features['after_protected'][location].extend(next_locs)
+
+    # Analyze transitions between protected areas
+    for i in range(len(features['protected_visits'])-1):
+        from_area = features['protected_visits'][i]
+        to_area = features['protected_visits'][i+1]
+        features['protected_transitions'][(from_area, to_area)] += 1
+
+    return features
+
+
+def encode_sequence_features(features, location_to_idx):
+    """
+    Copy of `features` with every location replaced by its integer code
+    (protected areas stay keyed by name), for cheaper similarity calls
+    """
+    encode = lambda seq: [location_to_idx[loc] for loc in seq]
+    return {
+        'sequence': encode(features['sequence']),
+        'protected_visits': encode(features['protected_visits']),
+        'before_protected': defaultdict(list, {area: encode(seq) for area, seq in features['before_protected'].items()}),
+        'after_protected': defaultdict(list, {area: encode(seq) for area, seq in features['after_protected'].items()}),
+        'protected_transitions': defaultdict(int, {(location_to_idx[a], location_to_idx[b]): count
+                                                   for (a, b), count in features['protected_transitions'].items()}),
+    }
+
+
+def lcs_length(seq1, seq2):
+    """Length of the longest common subsequence (bit-parallel, O(len(seq2)) big-int ops)"""
+    if len(seq1) < len(seq2):
+        seq1, seq2 = seq2, seq1  # fewer iterations over the shorter sequence
+    m = len(seq1)
+    if m == 0 or not seq2:
+        return 0
+    # Bit i of match[x] is set when seq1[i] == x
+    match = {}
+    for i, x in enumerate(seq1):
+        match[x] = match.get(x, 0) | (1 << i)
+    mask = (1 << m) - 1
+    v = mask
+    for x in seq2:
+        u = v & match.get(x, 0)
+        v = ((v + u) | (v - u)) & mask
+    # Every zero bit of v is one matched position
+    return m - bin(v).count('1')
+
+
+def calculate_sequence_similarity(seq1, seq2):
+    """Calculate similarity between two sequences"""
+    m, n = len(seq1), len(seq2)
+    return lcs_length(seq1, seq2) / max(m, n) if max(m, n) > 0 else 0
+
+
+def calculate_protected_similarity(features1, features2):
+    """Calculate similarity of protected area visit patterns"""
+    similarity = 0
+
+    # Protected area visit sequence similarity
+    seq_similarity = calculate_sequence_similarity(
+        features1['protected_visits'],
+        features2['protected_visits']
+    )
+    similarity += seq_similarity * 0.3
+
+    # Similarity of sequences before and after protected areas
+    for area in PROTECTED_AREAS:
+        # Similarity of sequences before protected area
+        before1 = features1['before_protected'][area]
+        before2 = features2['before_protected'][area]
+        if before1 and before2:
+            before_similarity = calculate_sequence_similarity(before1, before2)
+            similarity += before_similarity * 0.2
+
+        # Similarity of sequences after protected area
+        after1 = features1['after_protected'][area]
+        after2 = features2['after_protected'][area]
+        if after1 and after2:
+            after_similarity = calculate_sequence_similarity(after1, after2)
+            similarity += after_similarity * 0.2
+
+    # Similarity of transitions between protected areas
+    transitions1 = set(features1['protected_transitions'].keys())
+    transitions2 = set(features2['protected_transitions'].keys())
+    transition_similarity = len(transitions1 & transitions2) / max(len(transitions1 | transitions2), 1)
+    similarity += transition_similarity * 0.3
+
+    return similarity
+
+
+def _length_ratio(seq1, seq2):
+    # LCS / max length can be at most min length / max length
+    m, n = len(seq1), len(seq2)
+    return min(m, n) / max(m, n) if max(m, n) > 0 else 0
+
+
+def protected_similarity_bounds(features1, features2):
+    """
+    Cheap (lower, upper) bounds of calculate_protected_similarity: the
+    transition term is computed exactly, every LCS term is bounded by 0
+    below and by the length ratio of its sequences above.
+    """
+    transitions1 = set(features1['protected_transitions'].keys())
+    transitions2 = set(features2['protected_transitions'].keys())
+    transition_similarity = len(transitions1 & transitions2) / max(len(transitions1 | transitions2), 1)
+    lower = transition_similarity * 0.3
+
+    upper = _length_ratio(features1['protected_visits'], features2['protected_visits']) * 0.3
+    for area in PROTECTED_AREAS:
+        for key in ('before_protected', 'after_protected'):
+            seq1, seq2 = features1[key].get(area), features2[key].get(area)
+            if seq1 and seq2:
+                upper += _length_ratio(seq1, seq2) * 0.2
+    return lower, upper + lower
+
+
+# ── all-pairs matrix ─────────────────────────────────────────────────────────
+
+_worker_features = None
+
+
+def _init_similarity_worker(features):
+    # Each worker receives the sequence features once, not with every tile
+    global _worker_features
+    _worker_features = features
+
+
+def _similarity_tile(task):
+    tile, block = task
+    r0, r1, c0, c1 = tile
+    block = np.full((r1 - r0, c1 - c0), np.nan) if block is None else block.copy()
+    for i in range(r0, r1):
+        for j in range(max(i, c0), c1):
+            if np.isnan(block[i - r0, j - c0]):
+                block[i - r0, j - c0] = calculate_protected_similarity(_worker_features[i], _worker_features[j])
+    return tile, np.nan_to_num(block)
+
+
+def features_fingerprint(features):
+    """Hash of the sequence features that decide protected similarity"""
+    digest = hashlib.sha256()
+    for f in features:
+        digest.update(json.dumps([f['protected_visits'],
+                                  sorted((a, s) for a, s in f['before_protected'].items() if s),
+                                  sorted((a, s) for a, s in f['after_protected'].items() if s),
+                                  sorted(f['protected_transitions'])], default=str).encode())
+    return digest.hexdigest()
+
+
+# Subdirectory of the checkpoint dir holding the tiles; only its tile_*.npy
+# and meta.json files are ever deleted
+CHECKPOINT_SUBDIR = 'similarity_tiles'
+
+
+def _checkpoint_files(tile_dir):
+    if not os.path.isdir(tile_dir):
+        return []
+    return [name for name in os.listdir(tile_dir)
+            if name == 'meta.json' or (name.startswith('tile_') and name.endswith(('.npy', '.npy.tmp')))]
+
+
+def _clear_checkpoint(tile_dir):
+    """Delete the tiles and meta.json written to `tile_dir`, and the directory if that empties it"""
+    for name in _checkpoint_files(tile_dir):
+        os.remove(os.path.join(tile_dir, name))
+    if os.path.isdir(tile_dir) and not os.listdir(tile_dir):
+        os.rmdir(tile_dir)
+
+
+def _open_checkpoint(tile_dir, meta):
+    """Finished tiles in `tile_dir`, after discarding ones from other inputs"""
+    meta_path = os.path.join(tile_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            stale = json.load(f) != meta
+        if stale:
+            _clear_checkpoint(tile_dir)
+    os.makedirs(tile_dir, exist_ok=True)
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    done = {}
+    for name in os.listdir(tile_dir):
+        if name.startswith('tile_') and name.endswith('.npy'):
+            r0, c0 = map(int, name[len('tile_'):-len('.npy')].split('_'))
+            done[(r0, c0)] = np.load(os.path.join(tile_dir, name))
+    return done
+
+
+def _save_tile(tile_dir, tile, block):
+    path = os.path.join(tile_dir, f"tile_{tile[0]}_{tile[2]}.npy")
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, block)
+    os.replace(path + '.tmp', path)
+
+
+def protected_similarity_matrix(features, workers=1, tile_size=64, checkpoint_dir=None, progress=True,
+                                known=None):
+    """
+    Symmetric matrix of calculate_protected_similarity over `features`.
+
+    The upper triangle is cut into tile_size x tile_size tiles that are
+    computed by `workers` processes (1 = in this process). With a
+    `checkpoint_dir`, finished tiles are saved as they arrive (in its
+    CHECKPOINT_SUBDIR) and reused by the next call on the same features,
+    so an interrupted run resumes; they are deleted once the matrix is
+    complete. `known` is an n x n
+    matrix of already known similarities (NaN = unknown, see cached_pairs);
+    only the unknown pairs are computed.
+    """
+    n = len(features)
+    tiles = [(r0, min(r0 + tile_size, n), c0, min(c0 + tile_size, n))
+             for r0 in range(0, n, tile_size) for c0 in range(r0, n, tile_size)]
+    done = {}
+    tile_dir = None if checkpoint_dir is None else os.path.join(checkpoint_dir, CHECKPOINT_SUBDIR)
+    if tile_dir is not None:
+        meta = {'n': n, 'tile_size': tile_size, 'features': features_fingerprint(features)}
+        done = _open_checkpoint(tile_dir, meta)
+
+    matrix = np.zeros((n, n))
+    todo = []
+    for tile in tiles:
+        block = done.get((tile[0], tile[2]))
+        if block is None and known is not None:
+            block = known[tile[0]:tile[1], tile[2]:tile[3]]
+            if np.isnan(block).any():
+                todo.append((tile, block))
+                continue
+        if block is not None:
+            matrix[tile[0]:tile[1], tile[2]:tile[3]] = block
+        else:
+            todo.append((tile, None))
+    if progress and done:
+        print(f"Resuming similarity matrix: {len(tiles) - len(todo)}/{len(tiles)} tiles from {tile_dir}")
+
+    if workers <= 1 or len(todo) <= 1:
+        _init_similarity_worker(features)
+        results = map(_similarity_tile, todo)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_similarity_worker,
+                                       initargs=(features,))
+        futures = [executor.submit(_similarity_tile, task) for task in todo]
+        results = (future.result() for future in as_completed(futures))
+    try:
+        for count, (tile, block) in enumerate(results, 1):
+            matrix[tile[0]:tile[1], tile[2]:tile[3]] = block
+            if tile_dir is not None:
+                _save_tile(tile_dir, tile, block)
+            if progress and count % max(1, len(todo) // 20) == 0:
+                print(f"[{count}/{len(todo)}] similarity tiles done")
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    if tile_dir is not None:
+        _clear_checkpoint(tile_dir)
+    # Mirror the upper triangle (the diagonal is computed once)
+    return np.triu(matrix) + np.triu(matrix, 1).T
+
+
+def _similarity_pairs(task):
+    start, left, right = task
+    return start, np.array([calculate_protected_similarity(_worker_features[i], _worker_features[j])
+                            for i, j in zip(left.tolist(), right.tolist())], dtype=float)
+
+
+def protected_similarity_pairs(features, left, right, workers=1, chunk_size=4096, progress=True):
+    """
+    calculate_protected_similarity of the pairs (left[k], right[k]) only,
+    e.g. RouteLSHIndex.candidate_pairs, in chunks of `chunk_size` pairs
+    spread over `workers` processes (1 = in this process)
+    """
+    left, right = np.asarray(left, dtype=np.int64), np.asarray(right, dtype=np.int64)
+    values = np.zeros(len(left))
+    todo = [(start, left[start:start + chunk_size], right[start:start + chunk_size])
+            for start in range(0, len(left), chunk_size)]
+
+    if workers <= 1 or len(todo) <= 1:
+        _init_similarity_worker(features)
+        results = map(_similarity_pairs, todo)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_similarity_worker,
+                                       initargs=(features,))
+        futures = [executor.submit(_similarity_pairs, task) for task in todo]
+        results = (future.result() for future in as_completed(futures))
+    try:
+        for count, (start, block) in enumerate(results, 1):
+            values[start:start + len(block)] = block
+            if progress and count % max(1, len(todo) // 20) == 0:
+                print(f"[{count}/{len(todo)}] similarity pair chunks done")
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return values
+
+
+# ── persistent cache ─────────────────────────────────────────────────────────
+
+FEATURE_CACHE_FILE = 'sequence_features.pkl'
+PAIR_CACHE_FILE = 'pairs.npz'
+
+
+def route_hash(route):
+    """Content hash of one route (its time / location / dwell points)"""
+    return hashlib.sha256(json.dumps(route, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_similarity_cache(cache_dir):
+    """
+    (feature_cache, pair_cache) from `cache_dir`: route hash -> sequence
+    features, and (route hashes, sequence similarity matrix) or None when
+    nothing is cached yet
+    """
+    feature_cache, pair_cache = {}, None
+    feature_path = os.path.join(cache_dir, FEATURE_CACHE_FILE)
+    pair_path = os.path.join(cache_dir, PAIR_CACHE_FILE)
+    if os.path.exists(feature_path):
+        with open(feature_path, 'rb') as f:
+            feature_cache = pickle.load(f)
+    if os.path.exists(pair_path):
+        with np.load(pair_path) as pairs:
+            pair_cache = (pairs['hashes'].tolist(), pairs['matrix'])
+    return feature_cache, pair_cache
+
+
+def save_similarity_cache(cache_dir, feature_cache, hashes, matrix):
+    """
+    Keep the features and pair similarities of the current routes only
+    (`matrix` None: update the features, leave the cached pairs alone)
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    current = set(hashes)
+    feature_path = os.path.join(cache_dir, FEATURE_CACHE_FILE)
+    with open(feature_path + '.tmp', 'wb') as f:
+        pickle.dump({key: value for key, value in feature_cache.items() if key in current}, f)
+    os.replace(feature_path + '.tmp', feature_path)
+    if matrix is None:
+        return
+    pair_path = os.path.join(cache_dir, PAIR_CACHE_FILE)
+    with open(pair_path + '.tmp', 'wb') as f:
+        np.savez(f, hashes=np.array(hashes), matrix=matrix)
+    os.replace(pair_path + '.tmp', pair_path)
+
+
+def cached_pairs(hashes, cached_hashes, cached_matrix):
+    """n x n matrix of the cached similarities between `hashes` (NaN where unknown)"""
+    position = {key: i for i, key in enumerate(cached_hashes)}
+    rows = np.array([i for i, key in enumerate(hashes) if key in position], dtype=int)
+    cached_rows = np.array([position[hashes[i]] for i in rows], dtype=int)
+    known = np.full((len(hashes), len(hashes)), np.nan)
+    known[np.ix_(rows, rows)] = cached_matrix[np.ix_(cached_rows, cached_rows)]
+    return known
+
+
+def cached_pair_values(hashes, cached_hashes, cached_matrix, left, right):
+    """Cached similarities of the pairs (left[k], right[k]) of `hashes` (NaN where unknown)"""
+    position = {key: i for i, key in enumerate(cached_hashes)}
+    cached = np.array([position.get(key, -1) for key in hashes], dtype=np.int64)
+    values = np.full(len(left), np.nan)
+    found = (cached[left] >= 0) & (cached[right] >= 0)
+    values[found] = cached_matrix[cached[left][found], cached[right][found]]
+    return values
+
+
+# ── candidate index (MinHash / LSH) ──────────────────────────────────────────
+
+_MINHASH_PRIME = (1 << 31) - 1
+
+
+def route_shingles(features, n=3):
+    """
+    Shingles of what calculate_protected_similarity compares: 1..n-grams
+    of the protected visit sequence (its 2-grams are the transitions) and
+    every location before / after each protected area. Repeats are
+    numbered, so the Jaccard similarity of two shingle sets follows the
+    multiset overlap that the LCS terms reward.
+    """
+    visits = list(features['protected_visits'])
+    shingles = [('visit',) + tuple(visits[i:i + k]) for k in range(1, n + 1) for i in range(len(visits) - k + 1)]
+    for area in PROTECTED_AREAS:
+        shingles += [('before', area, loc) for loc in features['before_protected'].get(area, ())]
+        shingles += [('after', area, loc) for loc in features['after_protected'].get(area, ())]
+    seen = Counter()
+    numbered = set()
+    for shingle in shingles:
+        numbered.add((shingle, seen[shingle]))
+        seen[shingle] += 1
+    return numbered
+
+
+def minhash_signatures(shingle_sets, num_perm=128, seed=0):
+    """
+    (n, num_perm) MinHash signatures of the shingle sets, using the hashes
+    (a * x + b) mod 2^31-1 of each shingle's number in a shared vocabulary.
+    Empty sets get all-2^31-1 rows.
+    """
+    vocabulary = {}
+    # Number shingles in a fixed order: set order follows the per-process string hash seed
+    ids = [[vocabulary.setdefault(shingle, len(vocabulary)) for shingle in sorted(shingles, key=repr)]
+           for shingles in shingle_sets]
+    sizes = np.array([len(x) for x in ids], dtype=np.int64)
+    flat = np.fromiter(chain.from_iterable(ids), dtype=np.uint64, count=int(sizes.sum()))
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _MINHASH_PRIME, num_perm, dtype=np.uint64)
+    b = rng.integers(0, _MINHASH_PRIME, num_perm, dtype=np.uint64)
+
+    signatures = np.full((len(ids), num_perm), _MINHASH_PRIME, dtype=np.uint64)
+    nonempty = sizes > 0
+    if not nonempty.any():
+        return signatures
+    starts = (np.cumsum(sizes) - sizes)[nonempty]
+    # Hash a few permutations at a time to bound the (perm, shingle) block
+    step = max(1, (1 << 22) // len(flat))
+    for lo in range(0, num_perm, step):
+        hashed = (a[lo:lo + step, None] * flat[None, :] + b[lo:lo + step, None]) % _MINHASH_PRIME
+        signatures[nonempty, lo:lo + step] = np.minimum.reduceat(hashed, starts, axis=1).T
+    return signatures
+
+
+class RouteLSHIndex:
+    """
+    Banded LSH over the MinHash signatures of `features` (sequence
+    features in the order of the similarity matrix).
+
+    Vessels whose signatures agree on every row of at least one band are
+    candidates of each other; with b bands of r rows a pair with shingle
+    Jaccard similarity s becomes a candidate with probability
+    1 - (1 - s^r)^b. Vessels without protected visits have similarity 0
+    to everyone and are never candidates.
+    """
+
+    def __init__(self, features, bands=32, rows=4, shingle_n=3, seed=0):
+        shingles = [route_shingles(f, shingle_n) for f in features]
+        self.n = len(features)
+        self.indexed = np.array([bool(s) for s in shingles], dtype=bool)
+        signatures = minhash_signatures(shingles, bands * rows, seed)
+
+        # Per band: bucket of every vessel, and the vessels grouped by bucket
+        self.buckets = np.full((bands, self.n), -1, dtype=np.int64)
+        self.members, self.bucket_start = [], []
+        indexed = np.flatnonzero(self.indexed)
+        for band in range(bands):
+            block = np.ascontiguousarray(signatures[indexed, band * rows:(band + 1) * rows])
+            keys = block.view(np.dtype((np.void, block.itemsize * rows))).ravel()
+            _, bucket = np.unique(keys, return_inverse=True)
+            self.buckets[band, indexed] = bucket
+            order = np.argsort(bucket, kind='stable')
+            self.members.append(indexed[order])
+            self.bucket_start.append(np.searchsorted(bucket[order], np.arange(bucket.max(initial=-1) + 2)))
+
+    def candidates(self, i):
+        """Positions of the candidate similar vessels of vessel i (sorted, without i)"""
+        if not self.indexed[i]:
+            return np.zeros(0, dtype=np.int64)
+        found = [members[start[bucket]:start[bucket + 1]]
+                 for members, start, bucket in zip(self.members, self.bucket_start, self.buckets[:, i])]
+        found = np.unique(np.concatenate(found))
+        return found[found != i]
+
+    def candidate_pairs(self):
+        """
+        (left, right) positions of every candidate pair with left < right,
+        sorted, enumerated bucket by bucket (no n x n matrix)
+        """
+        keys = np.zeros(0, dtype=np.int64)
+        for members, start in zip(self.members, self.bucket_start):
+            sizes = np.diff(start)
+            band_keys = []
+            for lo, size in zip(start[:-1][sizes > 1].tolist(), sizes[sizes > 1].tolist()):
+                group = np.sort(members[lo:lo + size])
+                a, b = np.triu_indices(size, 1)
+                band_keys.append(group[a] * self.n + group[b])
+            if band_keys:
+                keys = np.union1d(keys, np.concatenate(band_keys))
+        return keys // max(self.n, 1), keys % max(self.n, 1)
+
+
+def candidate_recall(index, matrix, top_k=10):
+    """
+    Mean share of each vessel's exact top-k neighbours under `matrix`
+    (ties with the k-th value included, zero similarities left out) that
+    are among its LSH candidates, and the share of all pairs that are
+    candidates: (recall, candidate share)
+    """
+    recalls = []
+    for i in range(index.n):
+        row = np.delete(matrix[i], i)
+        others = np.delete(np.arange(index.n), i)
+        if top_k < len(row):
+            row_threshold = np.partition(row, -top_k)[-top_k]
+        else:
+            row_threshold = row.min(initial=0)
+        neighbours = others[(row >= row_threshold) & (row > 0)]
+        if len(neighbours):
+            recalls.append(np.isin(neighbours, index.candidates(i)).mean())
+    pairs = index.n * (index.n - 1) // 2
+    candidate_share = len(index.candidate_pairs()[0]) / pairs if pairs else 0
+    return (float(np.mean(recalls)) if recalls else 1.0), float(candidate_share)
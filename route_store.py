@@ -0,0 +1,326 @@
+"""
+Compact on-disk format for fishing vessel routes (extract_vessel_routes.py
+--format npz), an alternative to fishing_vessel_routes.json.
+
+One uncompressed .npz file holds every route point in shared arrays:
+
+    locations    location names (dictionary)
+    location     int32 code into `locations`, per point
+    time_start   int64 ns since epoch of each vessel's first point
+    time_delta   int64 ns since the vessel's previous point (0 for its first)
+    dwell        float32
+    latitude     float32, NaN when unknown
+    longitude    float32, NaN when unknown
+    offsets      int64, vessel i owns points offsets[i]:offsets[i + 1]
+    meta         JSON of the vessel metadata, in vessel order
+
+`CompactRoutes` memory-maps the per-point arrays, so slicing one vessel
+(or, with `select`, a vessel subset and time window) only reads those
+bytes; `merge_compact_routes` adds new points to an existing file.
+"""
+
+import json
+import os
+import struct
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from route_features import RouteTable, parse_route_times, warn_invalid_times
+
+FORMAT_VERSION = 1
+POINT_ARRAYS = ('location', 'time_delta', 'dwell', 'latitude', 'longitude')
+# Placeholder fishing_vessel_routes.json uses for missing values
+MISSING = '未知'
+
+
+def write_compact_routes(path, vessels, vessel_id, location, time, dwell, latitude=None, longitude=None,
+                         compress=False):
+    """
+    Write route points to a compact route file.
+
+    `vessels` are metadata dicts with a 'vessel_id', in output order; the
+    per-point columns may be lists or arrays (times as ISO strings or
+    datetime64, coordinates as numbers or MISSING). Points of vessels not
+    in `vessels` are dropped, and so are points whose time does not parse
+    (with a warning); each vessel's points are sorted by time. With
+    `compress` the file is smaller but is read whole instead of
+    memory-mapped.
+    """
+    vessel_ids = [vessel['vessel_id'] for vessel in vessels]
+    code = pd.Index(vessel_ids).get_indexer(pd.Series(vessel_id, dtype=object))
+    times, valid = parse_route_times(time)
+    warn_invalid_times(int((~valid & (code >= 0)).sum()))
+    keep = (code >= 0) & valid
+    times = times[keep]
+    code = code[keep]
+    order = np.lexsort((times, code))
+    code, times = code[order], times[order]
+
+    def column(values, dtype):
+        if values is None:
+            return np.full(len(order), np.nan, dtype=dtype)
+        values = pd.to_numeric(pd.Series(values, dtype=object)[keep], errors='coerce')
+        return values.to_numpy(dtype=dtype)[order]
+
+    location_codes, locations = pd.factorize(pd.Series(location, dtype=object)[keep].iloc[order], sort=True)
+    offsets = np.r_[0, np.cumsum(np.bincount(code, minlength=len(vessel_ids)))]
+    write_sorted_routes(path, vessels, offsets, locations, location_codes, times,
+                        column(dwell, np.float32), column(latitude, np.float32), column(longitude, np.float32),
+                        compress)
+
+
+def write_sorted_routes(path, vessels, offsets, locations, location, time, dwell, latitude, longitude,
+                        compress=False):
+    """
+    Write points that are already grouped by vessel (in `vessels` order,
+    vessel i owning rows offsets[i]:offsets[i + 1]) and time-sorted within
+    each vessel; `location` are codes into `locations`, `time` epoch ns
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    times = np.asarray(time, dtype=np.int64)
+    counts = np.diff(offsets)
+    starts = offsets[:-1][counts > 0]
+    time_start = np.zeros(len(vessels), dtype=np.int64)
+    time_start[counts > 0] = times[starts]
+    time_delta = np.diff(times, prepend=times[:1])
+    time_delta[starts] = 0
+
+    arrays = {
+        'version': np.array(FORMAT_VERSION),
+        'meta': np.array(json.dumps(vessels, ensure_ascii=False, default=str)),
+        'locations': np.array(list(locations), dtype=str),
+        'offsets': offsets,
+        'time_start': time_start,
+        'location': np.asarray(location, dtype=np.int32),
+        'time_delta': time_delta,
+        'dwell': np.asarray(dwell, dtype=np.float32),
+        'latitude': np.asarray(latitude, dtype=np.float32),
+        'longitude': np.asarray(longitude, dtype=np.float32),
+    }
+    with open(path + '.tmp', 'wb') as f:
+        (np.savez_compressed if compress else np.savez)(f, **arrays)
+    os.replace(path + '.tmp', path)
+
+
+def _npz_memmap(path, name):
+    """Memory-map member `name` of an uncompressed .npz (None when it is compressed)"""
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(name + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+    with open(path, 'rb') as f:
+        # Local file header: 30 fixed bytes, then file name and extra field
+        f.seek(info.header_offset)
+        name_length, extra_length = struct.unpack('<HH', f.read(30)[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if not np.prod(shape):
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+class CompactRoutes:
+    """
+    Reader for a compact route file.
+
+    With `mmap` (the default) the per-point arrays are memory-mapped, so
+    `vessel` touches only that vessel's rows; `table` and `to_routes` read
+    everything.
+    """
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        with np.load(path) as npz:
+            if int(npz['version']) != FORMAT_VERSION:
+                raise ValueError(f"{path}: unsupported route file version {int(npz['version'])}")
+            self.vessels = json.loads(str(npz['meta']))
+            self.locations = npz['locations'].astype(object)
+            self.offsets = npz['offsets']
+            self.time_start = npz['time_start']
+            points = {name: None if mmap else npz[name] for name in POINT_ARRAYS}
+        for name in POINT_ARRAYS:
+            if points[name] is None:
+                points[name] = _npz_memmap(path, name)
+            if points[name] is None:  # compressed file: read the array
+                with np.load(path) as npz:
+                    points[name] = npz[name]
+            setattr(self, name, points[name])
+        self.vessel_ids = [vessel['vessel_id'] for vessel in self.vessels]
+        self._position = {vessel_id: i for i, vessel_id in enumerate(self.vessel_ids)}
+
+    def __len__(self):
+        return len(self.vessel_ids)
+
+    def __contains__(self, vessel_id):
+        return vessel_id in self._position
+
+    def _times(self, i, start, end):
+        return self.time_start[i] + np.cumsum(self.time_delta[start:end])
+
+    def vessel(self, vessel_id):
+        """Time-sorted points of one vessel: time / location / dwell / latitude / longitude"""
+        i = self._position[vessel_id]
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return pd.DataFrame({
+            'time': self._times(i, start, end).view('datetime64[ns]'),
+            'location': self.locations[self.location[start:end]],
+            'dwell': np.asarray(self.dwell[start:end]),
+            'latitude': np.asarray(self.latitude[start:end]),
+            'longitude': np.asarray(self.longitude[start:end]),
+        })
+
+    def _all_times(self):
+        counts = np.diff(self.offsets)
+        total = np.cumsum(self.time_delta)
+        # Restart the running sum at every vessel's first point
+        before = np.repeat(total[self.offsets[:-1][counts > 0]], counts[counts > 0])
+        return np.repeat(self.time_start, counts) + total - before
+
+    def table(self):
+        """All points as a route_features.RouteTable"""
+        vessel = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+        return RouteTable(self.vessel_ids, self.locations, vessel, np.asarray(self.location), self._all_times(),
+                          np.asarray(self.dwell, dtype=np.float64))
+
+    def select(self, vessel_ids=None, locations=None, start=None, end=None):
+        """
+        RouteTable of only `vessel_ids`, `locations` and start <= time < end
+        (anything pd.Timestamp accepts), vessels in file order; vessels
+        left without points are dropped.
+
+        Each selected vessel's window is binary-searched on its times, so
+        a memory-mapped file only reads the time deltas of the selected
+        vessels and the other arrays inside their windows.
+        """
+        if vessel_ids is None:
+            chosen = range(len(self))
+        else:
+            chosen = sorted(self._position[vessel_id] for vessel_id in set(vessel_ids) if vessel_id in self)
+        first = None if start is None else pd.Timestamp(start).value
+        stop = None if end is None else pd.Timestamp(end).value
+        windows, times = [], []
+        for i in chosen:
+            lo, hi = int(self.offsets[i]), int(self.offsets[i + 1])
+            vessel_times = self._times(i, lo, hi)
+            a = 0 if first is None else int(np.searchsorted(vessel_times, first))
+            b = hi - lo if stop is None else int(np.searchsorted(vessel_times, stop))
+            if a < b:
+                windows.append((i, lo + a, lo + b))
+                times.append(vessel_times[a:b])
+
+        def gather(values):
+            return np.concatenate([values[lo:hi] for _, lo, hi in windows] or [values[:0]])
+
+        vessel = np.repeat(np.arange(len(windows)), [hi - lo for _, lo, hi in windows])
+        location, dwell = gather(self.location), gather(self.dwell).astype(np.float64)
+        time = np.concatenate(times or [np.zeros(0, dtype=np.int64)])
+        if locations is not None:
+            keep = np.isin(self.locations[location], list(locations))
+            vessel, location, time, dwell = vessel[keep], location[keep], time[keep], dwell[keep]
+        present, vessel = np.unique(vessel, return_inverse=True)
+        vessel_ids = [self.vessel_ids[windows[k][0]] for k in present.tolist()]
+        return RouteTable(vessel_ids, self.locations, vessel, location, time, dwell)
+
+    def to_routes(self):
+        """Routes in the layout of fishing_vessel_routes.json"""
+        times = pd.to_datetime(self._all_times()).strftime('%Y-%m-%dT%H:%M:%S.%f').to_numpy()
+        locations = self.locations[self.location]
+        dwell = np.asarray(self.dwell, dtype=np.float64).tolist()
+        latitude = np.asarray(self.latitude, dtype=np.float64)
+        longitude = np.asarray(self.longitude, dtype=np.float64)
+        latitude = np.where(np.isnan(latitude), MISSING, latitude.astype(object)).tolist()
+        longitude = np.where(np.isnan(longitude), MISSING, longitude.astype(object)).tolist()
+
+        fishing_vessels = []
+        for vessel, start, end in zip(self.vessels, self.offsets[:-1].tolist(), self.offsets[1:].tolist()):
+            route = [{'time': t, 'location': loc, 'dwell': d, 'latitude': lat, 'longitude': lon}
+                     for t, loc, d, lat, lon in zip(times[start:end], locations[start:end], dwell[start:end],
+                                                    latitude[start:end], longitude[start:end])]
+            fishing_vessels.append({**vessel, 'route_points': len(route), 'route': route})
+        return {'total_fishing_vessels': len(fishing_vessels), 'fishing_vessels': fishing_vessels}
+
+
+def merge_compact_routes(path, vessels, vessel_id, location, time, dwell, latitude=None, longitude=None):
+    """
+    Merge new route points into the compact route file at `path`, in place.
+
+    `vessels` are metadata dicts of new or updated vessels: they replace
+    the stored metadata of the same vessel_id, and vessels not stored yet
+    are appended when they have new points. Points of unknown vessels are
+    dropped, and so are points whose time does not parse (with a warning).
+    Points already stored (same vessel, time and location) are skipped,
+    so overlapping updates do not add duplicates. Every other new point
+    goes after the stored points of its vessel with the same or an earlier
+    time; only the vessels that got points are searched, the rest is
+    copied. Returns (points added, vessels touched).
+    """
+    routes = CompactRoutes(path)
+    metadata = {vessel['vessel_id']: vessel for vessel in routes.vessels}
+    updates = {vessel['vessel_id']: vessel for vessel in vessels}
+    for key, vessel in updates.items():
+        metadata[key] = {**metadata.get(key, {}), **vessel}
+
+    # New points, grouped by vessel and time-sorted like write_compact_routes
+    new_ids = pd.Series(vessel_id, dtype=object)
+    times, valid = parse_route_times(time)
+    appended = [key for key in pd.unique(new_ids[valid]) if key in updates and key not in routes]
+    order_ids = routes.vessel_ids + appended
+    code = pd.Index(order_ids).get_indexer(new_ids)
+    warn_invalid_times(int((~valid & new_ids.isin(order_ids + list(updates)).to_numpy()).sum()))
+    keep = (code >= 0) & valid
+    times = times[keep]
+    code = code[keep]
+    order = np.lexsort((times, code))
+    code, times = code[order], times[order]
+
+    def column(values):
+        if values is None:
+            return np.full(len(code), np.nan, dtype=np.float32)
+        values = pd.to_numeric(pd.Series(values, dtype=object)[keep], errors='coerce')
+        return values.to_numpy(dtype=np.float32)[order][fresh]
+
+    # Insertion point of every new point in the stored arrays, and the
+    # stored points of its vessel with the same time
+    old_offsets = np.r_[routes.offsets, np.full(len(appended), routes.offsets[-1])].astype(np.int64)
+    old_times = routes._all_times()
+    positions = np.empty(len(code), dtype=np.int64)
+    same_time = np.empty(len(code), dtype=np.int64)
+    groups = np.flatnonzero(np.r_[True, code[1:] != code[:-1]]) if len(code) else np.zeros(0, dtype=int)
+    for lo, hi in zip(groups, np.r_[groups[1:], len(code)]):
+        start, end = old_offsets[code[lo]], old_offsets[code[lo] + 1]
+        positions[lo:hi] = start + np.searchsorted(old_times[start:end], times[lo:hi], side='right')
+        same_time[lo:hi] = start + np.searchsorted(old_times[start:end], times[lo:hi], side='left')
+
+    # Points already stored (same vessel, time and location) are dropped
+    new_locations = pd.Series(location, dtype=object)[keep].to_numpy()[order]
+    old_names = np.asarray(routes.locations, dtype=object)[np.asarray(routes.location)]
+    stored = np.zeros(len(code), dtype=bool)
+    span = positions - same_time
+    for k in range(int(span.max()) if len(span) else 0):
+        check = span > k
+        stored[check] |= old_names[same_time[check] + k] == new_locations[check]
+    fresh = ~stored
+    code, times, positions, new_locations = code[fresh], times[fresh], positions[fresh], new_locations[fresh]
+    touched = np.unique(code)
+
+    # Location dictionary of stored and new points
+    locations = np.array(sorted(set(routes.locations.tolist()) | set(new_locations.tolist())), dtype=object)
+    old_location = np.searchsorted(locations, routes.locations)[np.asarray(routes.location)]
+
+    offsets = old_offsets + np.r_[0, np.cumsum(np.bincount(code, minlength=len(order_ids)))]
+    write_sorted_routes(path, [metadata[key] for key in order_ids], offsets, locations,
+                        np.insert(old_location, positions, np.searchsorted(locations, new_locations)),
+                        np.insert(old_times, positions, times),
+                        np.insert(np.asarray(routes.dwell), positions, column(dwell)),
+                        np.insert(np.asarray(routes.latitude), positions, column(latitude)),
+                        np.insert(np.asarray(routes.longitude), positions, column(longitude)))
+    return len(code), len(touched)
+
@@ -8,11 +8,15 @@ MC2 · Fishing‑Cycle Sunburst (Enhanced v1.6.4)
 
 from pathlib import Path
 import json, sys, warnings, webbrowser
-import numpy as np, pandas as pd, networkx as nx
+import numpy as np, pandas as pd
 from sklearn.preprocessing import StandardScaler
-from scipy.cluster.hierarchy import linkage, to_tree
 import plotly.express as px
 
+from cluster_tree import ClusterTree, cluster_linkage
+from cycle_analysis import (filter_cycles_with_features, parse_pings,
+                            split_cycles, vessel_preserve_stats)
+from mc2_loader import TRANSPONDER_PING, PingSink, RecordSink, load_mc2
+
 warnings.filterwarnings("ignore")
 
 # ───────── 参数区 ─────────
@@ -23,6 +27,11 @@ EP_KIND     = "ecological preserve"
 MIN_PINGS   = 3
 SAMPLE_CYCLES = None
 COLOR_RANGE = [0, 0.4]
+CLUSTER_METHOD = "ward"   # ward | kmeans | birch（后两者先预聚类再对中心做 Ward，适合大规模周期）
+N_CENTROIDS = 2000        # kmeans 预聚类中心数（周期数不超过它时直接用 ward）
+SUNBURST_MAX_DEPTH = None  # 只画到这一层，更深的子树汇总成一个节点（None: 全部画出）
+MIN_CLUSTER_SIZE = 1       # 周期数少于它的簇不再展开，汇总显示
+EXPLORER_SIDECAR = False  # True: 簇浏览数据另存为 *.explorer.json，搜索时再按需加载（需通过 http 打开页面）
 
 # Sunburst 尺寸
 FIG_WIDTH  = 1200
@@ -33,14 +42,15 @@ dbg = lambda m: print(f"[DBG] {m}")
 # 1. 读图 ---------------------------------------------------------------
 if not DATA_FILE.exists():
     sys.exit(f"❌ {DATA_FILE} 不存在")
-G = nx.node_link_graph(json.loads(DATA_FILE.read_text()),
-                       directed=True, multigraph=True)
-dbg(f"Nodes: {G.number_of_nodes():,}  Edges: {G.number_of_edges():,}")
-
-nodes = (pd.DataFrame.from_dict(dict(G.nodes(data=True)), orient="index")
-         .reset_index().rename(columns={'index': 'id'}))
-edges = pd.DataFrame([{'source': u, 'target': v, **d}
-                      for u, v, k, d in G.edges(keys=True, data=True)])
+# 流式读取：节点直接进表，边只保留 TransponderPing 的所需列
+node_sink = RecordSink()
+ping_sink = PingSink(extra_fields=('type',))
+load_mc2(DATA_FILE, node_sinks={'': node_sink},
+         link_sinks={TRANSPONDER_PING: ping_sink})
+nodes = pd.DataFrame(node_sink.records)
+edges = ping_sink.to_frame()
+dbg(f"Nodes: {len(nodes):,}  Ping edges: {len(edges):,}")
+del node_sink, ping_sink
 edges['type'] = edges['type'].astype(str).str.strip()
 
 # 2. 基础集合 -----------------------------------------------------------
@@ -60,42 +70,16 @@ dbg(f"SouthSeafood Express Corp vessels: {len(SSE_VESSELS)}")
 
 # 3. 解析 Ping ----------------------------------------------------------
 ping_raw = edges[edges['type'].str.contains("TransponderPing", case=False)]
-def parse_ping(r):
-    s, t = r['source'], r['target']
-    if s in vessel_ids and t not in vessel_ids:  return s, t
-    if t in vessel_ids and s not in vessel_ids:  return t, s
-    return None, None
-
-records = []
-for _, r in ping_raw.iterrows():
-    vid, lid = parse_ping(r)
-    if vid:
-        records.append([vid, lid,
-                        pd.to_datetime(r['time'], errors='coerce'),
-                        float(r.get('dwell', 0))])
-pings = pd.DataFrame(records, columns=['vessel_id','location_id','time','dwell'])
+# 向量化解析：isin 判定船只端点 + 一次性 to_datetime
+pings = parse_pings(ping_raw, vessel_ids)
 dbg(f"Valid pings: {len(pings):,}")
 
 # 4. 切分周期 -----------------------------------------------------------
-def split_cycles(df):
-    cycles, buf, in_trip = [], [], False
-    for _, row in df.iterrows():
-        is_port = row.location_id in PORT_IDS
-        if not in_trip and not is_port: buf=[row]; in_trip=True
-        elif in_trip and not is_port:  buf.append(row)
-        elif in_trip and is_port:
-            if len(buf) >= MIN_PINGS: cycles.append(pd.DataFrame(buf))
-            in_trip=False; buf=[]
-    return cycles
-
-cycle_frames=[]
-for vid, grp in pings.groupby('vessel_id', sort=False):
-    for i, cyc in enumerate(split_cycles(grp.sort_values('time')),1):
-        cyc['cycle_id']=f"{vid}_{i}"; cycle_frames.append(cyc)
-if not cycle_frames:
+# 向量化切分：按 (vessel, time) 排序后用布尔掩码 + 累加和标出每段航程
+cycles_df = split_cycles(pings, PORT_IDS, MIN_PINGS)
+if cycles_df.empty:
     sys.exit("❌ 0 周期")
 
-cycles_df = pd.concat(cycle_frames, ignore_index=True)
 dbg(f"All cycles before sampling: {cycles_df.cycle_id.nunique():,}")
 
 # —— 抽样 —— -----------------------------------------------------------
@@ -106,33 +90,20 @@ if SAMPLE_CYCLES and cycles_df.cycle_id.nunique() > SAMPLE_CYCLES:
     dbg(f"Cycles after random sampling to {SAMPLE_CYCLES}: "
         f"{cycles_df.cycle_id.nunique():,}")
 
-# 5. 过滤阶段 -----------------------------------------------------------
-# 5‑1 去掉没有 fishing‑ground 的周期
+# 5. 过滤阶段 + 6. 特征矩阵 ---------------------------------------------
+# 一次聚合：预先算出 is_fg / is_ep 列，按周期求 any，并同时得到 kind 透视表
 FG_IDS = set(loc_meta.loc[loc_meta['kind'] == 'fishing ground', 'id'])
-before_fg = cycles_df.cycle_id.nunique()
-has_fg = cycles_df.groupby('cycle_id')['location_id'] \
-                  .apply(lambda col: col.isin(FG_IDS).any())
-cycles_df = cycles_df[cycles_df.cycle_id.isin(has_fg[has_fg].index)].copy()
-dbg(f"Cycles with fishing‑ground: {cycles_df.cycle_id.nunique():,} "
-    f"(filtered {before_fg - cycles_df.cycle_id.nunique():,})")
-
-# 5‑2 去掉没有 preserve 的周期
 PRESERVE_IDS = set(loc_meta.loc[loc_meta['kind'] == 'ecological preserve', 'id'])
-before_ep = cycles_df.cycle_id.nunique()
-has_ep = cycles_df.groupby('cycle_id')['location_id'] \
-                  .apply(lambda col: col.isin(PRESERVE_IDS).any())
-cycles_df = cycles_df[cycles_df.cycle_id.isin(has_ep[has_ep].index)].copy()
-dbg(f"Cycles with preserve: {cycles_df.cycle_id.nunique():,} "
-    f"(filtered {before_ep - cycles_df.cycle_id.nunique():,})")
+cycles_df, feat, n_cycles = filter_cycles_with_features(
+    cycles_df, loc_meta, FG_IDS, PRESERVE_IDS)
+# 5‑1 去掉没有 fishing‑ground 的周期
+dbg(f"Cycles with fishing‑ground: {n_cycles['with_fg']:,} "
+    f"(filtered {n_cycles['all'] - n_cycles['with_fg']:,})")
+# 5‑2 去掉没有 preserve 的周期
+dbg(f"Cycles with preserve: {n_cycles['with_ep']:,} "
+    f"(filtered {n_cycles['with_fg'] - n_cycles['with_ep']:,})")
 
 dbg(f"Final rows in cycles_df: {len(cycles_df):,}")
-
-# 6. 特征矩阵 -----------------------------------------------------------
-feat = (cycles_df.groupby(['cycle_id', 'location_id'])['dwell']
-        .sum().reset_index()
-        .merge(loc_meta, left_on='location_id', right_on='id', how='left')
-        .pivot_table(index='cycle_id', columns='kind', values='dwell',
-                     aggfunc='sum', fill_value=0))
 dbg(f"Feature matrix shape: {feat.shape}")
 
 feat['fg_ratio'] = feat.get(FG_KIND, 0) / feat.sum(axis=1)
@@ -143,80 +114,29 @@ feat['is_sse'] = feat['vessel_id'].isin(SSE_VESSELS)
 dbg(f"Distinct vessels in final cycles: {feat['vessel_id'].nunique():,}")
 
 # 7. 风险船只 -----------------------------------------------------------
-vessel_stats = (cycles_df.groupby('vessel_id')
-                .apply(lambda g: pd.Series({
-                    'ep_dwell': g[g['location_id'].isin(PRESERVE_IDS)]['dwell'].sum(),
-                    'total_dwell': g['dwell'].sum()
-                }), include_groups=False)
-                .assign(ep_ratio=lambda x: x['ep_dwell'] / x['total_dwell'])
-                .sort_values('ep_ratio', ascending=False))
+vessel_stats = vessel_preserve_stats(cycles_df)
 dbg(f"Vessels after risk calc: {len(vessel_stats):,}")
 
 # 8. 聚类 & Sunburst 数据 -----------------------------------------------
 X = StandardScaler().fit_transform(feat.select_dtypes(float))
 dbg("StandardScaler done.")
-Z = linkage(X, method="ward")
-dbg("Hierarchical clustering done.")
-
-labels = feat.index.to_list()
-
-def build(node):
-    if node.left is None and node.right is None:
-        idx = node.id
-        return dict(name=labels[idx],
-                    value=1,
-                    weight=1,
-                    color=float(feat.iloc[idx]['fg_ratio']),
-                    ep=float(feat.iloc[idx]['ep_ratio']))
-    left  = build(node.left)
-    right = build(node.right)
-    w_sum = left['weight'] + right['weight']
-    return dict(children=[left, right],
-                weight=w_sum,
-                color=(left['color']*left['weight'] + right['color']*right['weight'])/w_sum,
-                ep=(left['ep']*left['weight'] + right['ep']*right['weight'])/w_sum)
-
-sun = build(to_tree(Z))
-dbg("Sunburst hierarchy built.")
-
-def flat(n, parent=""):
-    nid = n.get('name') or f"cluster_{id(n)}"
-    rows = [dict(id=nid, parent=parent,
-                 value=n.get('value', 1),
-                 color=n.get('color', np.nan),
-                 ep=n.get('ep', np.nan))]
-    for ch in n.get('children', []):
-        rows += flat(ch, nid)
-    return rows
-
-flat_df = pd.DataFrame(flat(sun))
-dbg(f"Flattened nodes for sunburst: {len(flat_df):,}")
+Z, groups = cluster_linkage(X, method=CLUSTER_METHOD, n_centroids=N_CENTROIDS)
+dbg(f"Hierarchical clustering done ({CLUSTER_METHOD}, {len(Z) + 1:,} linkage leaves).")
+
+tree = ClusterTree(Z, groups, feat.index, feat['fg_ratio'], feat['ep_ratio'])
+flat_df = tree.to_frame()
+plot_df = tree.to_frame(SUNBURST_MAX_DEPTH, MIN_CLUSTER_SIZE)
+dbg(f"Flattened nodes for sunburst: {len(flat_df):,} ({len(plot_df):,} drawn)")
 
 # 9. cluster → cycles / vessels 映射 ------------------------------------
-cycle_ids = set(cycles_df.cycle_id)
-children_map = {}
-for row in flat_df.itertuples():
-    children_map.setdefault(row.parent, []).append(row.id)
-
-def collect_leaves(node_id):
-    leaves, stack = [], [node_id]
-    while stack:
-        n = stack.pop()
-        if n in cycle_ids:
-            leaves.append(n)
-        stack.extend(children_map.get(n, []))
-    return leaves
-
-cluster_cycles = {}
-cluster_vessels = {}
-for node_id in flat_df['id']:
-    if node_id in cycle_ids:
-        continue
-    leaves = collect_leaves(node_id)
-    if leaves:
-        cluster_cycles[node_id] = leaves
-        cluster_vessels[node_id] = sorted({c.split('_')[0] for c in leaves})
-dbg(f"Total non‑leaf clusters: {len(cluster_cycles):,}")
+# 紧凑编码：周期 id / 船只名各出现一次，簇只记录叶子区间 [start, end)
+explorer = tree.explorer_payload(pd.Series(tree.leaves).str.split('_').str[0])
+explorer_json = json.dumps(explorer, separators=(',', ':'))
+if EXPLORER_SIDECAR:
+    explorer_file = Path(OUTPUT_HTML).with_suffix('.explorer.json')
+    explorer_file.write_text(explorer_json, encoding='utf-8')
+    dbg(f"Explorer data written to {explorer_file} ({len(explorer_json) / 1e6:.1f} MB)")
+dbg(f"Total non‑leaf clusters: {len(tree.clusters()):,}")
 
 # ───────── HTML 构建辅助函数（同上一版） ─────────
 def risky_table(stats):
@@ -262,12 +182,16 @@ def sse_chains():
     return html
 
 # 10. Sunburst ----------------------------------------------------------
+# 截断后的汇总节点：悬停时显示其包含的周期数，可在下方 Cluster 搜索中展开
+hover = {'color':':.2f', 'ep':':.2f'}
+if len(plot_df) < len(flat_df):
+    hover['cycles'] = True
 fig = px.sunburst(
-    flat_df,
+    plot_df,
     names="id", parents="parent", values="value",
     color='color', color_continuous_scale='RdYlBu_r',
     range_color=COLOR_RANGE,
-    hover_data={'color':':.2f', 'ep':':.2f'}
+    hover_data=hover
 )
 fig.update_traces(textinfo='none')
 fig.update_layout(
@@ -320,19 +244,39 @@ body {{font-family: Arial, Helvetica, sans-serif;}}
 </div>
 
 <script>
-const clusterCycles  = {json.dumps(cluster_cycles)};
-const clusterVessels = {json.dumps(cluster_vessels)};
+// 簇 cluster_i 的周期是 cycles[start[i]:end[i]]；叶子节点只覆盖 1 个周期
+let explorer = {"null" if EXPLORER_SIDECAR else explorer_json};
+const explorerUrl = {json.dumps(Path(OUTPUT_HTML).with_suffix('.explorer.json').name)};
 const infoDiv  = document.getElementById('cluster-info');
 const inputBox = document.getElementById('cluster-input');
 const searchBtn= document.getElementById('cluster-search');
 
-function showCluster(id) {{
-    if (!(id in clusterCycles)) {{
+async function loadExplorer() {{
+    if (!explorer) {{
+        const resp = await fetch(explorerUrl);
+        if (!resp.ok) throw new Error(`${{explorerUrl}}: HTTP ${{resp.status}}`);
+        explorer = await resp.json();
+    }}
+    return explorer;
+}}
+
+async function showCluster(id) {{
+    let data;
+    try {{
+        data = await loadExplorer();
+    }} catch (err) {{
+        infoDiv.innerHTML = `<p style="color:red;">Could not load cluster data (${{err.message}}).</p>`;
+        return;
+    }}
+    const m = /^cluster_([0-9]+)$/.exec(id);
+    const i = m ? Number(m[1]) : -1;
+    if (i < 0 || i >= data.start.length || data.end[i] - data.start[i] < 2) {{
         infoDiv.innerHTML = `<p style="color:red;">Cluster “${{id}}” not found.</p>`;
         return;
     }}
-    const cycles  = clusterCycles[id];
-    const vessels = clusterVessels[id];
+    const cycles  = data.cycles.slice(data.start[i], data.end[i]);
+    const codes   = [...new Set(data.cycleVessel.slice(data.start[i], data.end[i]))].sort((a, b) => a - b);
+    const vessels = codes.map(c => data.vessels[c]);
     let html = `<h4>Cluster: ${{id}}</h4>`;
     html += `<p><strong>Vessels (${{vessels.length}}):</strong> ${{vessels.join(', ')}}</p>`;
     html += `<details open><summary>Cycles (${{cycles.length}})</summary><ul>`;
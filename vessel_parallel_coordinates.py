@@ -1,13 +1,12 @@
-import json
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
 import numpy as np  # Add numpy import
 
-# Read JSON data
-with open('./fishing_vessel_routes.json', 'r') as f:
-    data = json.load(f)
+from mc2_loader import FISHING_VESSEL
+from ping_store import load_vessels
+from route_features import load_route_table
 
 # Define the list of vessel IDs to display
 target_vessel_ids = [
@@ -32,50 +31,17 @@ target_vessel_ids = [
 # Define protected areas list (sorted alphabetically)
 protected_areas = sorted(['Don Limpet Preserve', 'Ghoti Preserve', 'Nemo Reef'])
 
-# Process all vessel data
-all_processed_data = []
-protected_processed_data = []
-vessels_through_protected = set()
+# Read only the target vessels' routes from the columnar ping store as one flat table
+routes = load_route_table(vessel_ids=target_vessel_ids)
+companies = load_vessels(vessel_type=FISHING_VESSEL).set_index('id')['company']
 
-# Process all vessel data
-for vessel in data['fishing_vessels']:
-    vessel_id = vessel['vessel_id']
-    if vessel_id not in target_vessel_ids:
-        continue
-        
-    company = vessel['company']
-    has_visited_protected = False
-    
-    for route_point in vessel['route']:
-        # Extract time part (format: 2023-01-01T12:34:56.789307)
-        time_parts = route_point['time'].split('T')[1].split('.')[0].split(':')
-        hours = float(time_parts[0]) + float(time_parts[1])/60 + float(time_parts[2])/3600
-        
-        # Add to all vessel data
-        all_processed_data.append({
-            'vessel_id': vessel_id,
-            'company': company,
-            'location': route_point['location'],
-            'time': hours,  # Use hours
-            'dwell': route_point['dwell']
-        })
-        
-        # Check if vessel has visited protected area
-        if route_point['location'] in protected_areas:
-            has_visited_protected = True
-            vessels_through_protected.add(vessel_id)
-            # Only add data related to protected area
-            protected_processed_data.append({
-                'vessel_id': vessel_id,
-                'company': company,
-                'location': route_point['location'],
-                'time': hours,  # Use hours
-                'dwell': route_point['dwell']
-            })
+# Route points of the target vessels, with the hour of day as time
+all_df = routes.to_frame()
+all_df.insert(1, 'company', all_df['vessel_id'].map(companies))
 
-# Convert to DataFrame
-all_df = pd.DataFrame(all_processed_data)
-protected_df = pd.DataFrame(protected_processed_data)
+# Only keep data related to protected areas
+protected_df = all_df[all_df['location'].isin(protected_areas)].reset_index(drop=True)
+vessels_through_protected = set(protected_df['vessel_id'])
 
 # Calculate average dwell time for each protected area
 protected_avg_dwell = protected_df.groupby('location')['dwell'].mean().reset_index()
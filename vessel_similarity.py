@@ -1,214 +1,209 @@
-import json
 import pandas as pd
 import numpy as np
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics.pairwise import cosine_similarity
 import plotly.express as px
 import plotly.graph_objects as go
-from collections import Counter, defaultdict
-from itertools import combinations
-
-# Read JSON data
-with open('./fishing_vessel_routes.json', 'r') as f:
-    data = json.load(f)
-
-# Define protected areas
-protected_areas = ['Don Limpet Preserve', 'Ghoti Preserve', 'Nemo Reef']
-
-# Get all possible locations
-all_locations = set()
-for vessel in data['fishing_vessels']:
-    for point in vessel['route']:
-        all_locations.add(point['location'])
-all_locations = sorted(list(all_locations))
-
-# Create location index mapping
-location_to_idx = {loc: idx for idx, loc in enumerate(all_locations)}
-
-def get_location_sequence_features(route):
-    """Calculate location sequence features"""
-    # Initialize features
-    features = {
-        'sequence': [],  # Location sequence
-        'protected_visits': [],  # Protected area visit sequence
-        'before_protected': defaultdict(list),  # Sequence before protected areas
-        'after_protected': defaultdict(list),  # Sequence after protected areas
-        'protected_transitions': defaultdict(int)  # Transitions between protected areas
-    }
-    
-    # Record location sequence
-    for point in route:
-        location = point['location']
-        features['sequence'].append(location)
-        if location in protected_areas:
-            features['protected_visits'].append(location)
-    
-    # Analyze sequences before and after protected areas
-    for i, location in enumerate(features['sequence']):
-        if location in protected_areas:
-            # Record two locations before protected area
-            if i >= 2:
-                prev_locs = features['sequence'][i-2:i]
-                if not any(loc in protected_areas for loc in prev_locs):
-                    features['before_protected'][location].extend(prev_locs)
-            
-            # Record two locations after protected area
-            if i < len(features['sequence'])-2:
-                next_locs = features['sequence'][i+1:i+3]
-                if not any(loc in protected_areas for loc in next_locs):
-                    features['after_protected'][location].extend(next_locs)
-    
-    # Analyze transitions between protected areas
-    for i in range(len(features['protected_visits'])-1):
-        from_area = features['protected_visits'][i]
-        to_area = features['protected_visits'][i+1]
-        features['protected_transitions'][(from_area, to_area)] += 1
-    
-    return features
+from scipy import sparse
+import argparse
+import os
+import time
 
-def calculate_sequence_similarity(seq1, seq2):
-    """Calculate similarity between two sequences"""
-    # Use longest common subsequence algorithm
-    m, n = len(seq1), len(seq2)
-    dp = [[0] * (n + 1) for _ in range(m + 1)]
-    
-    for i in range(1, m + 1):
-        for j in range(1, n + 1):
-            if seq1[i-1] == seq2[j-1]:
-                dp[i][j] = dp[i-1][j-1] + 1
-            else:
-                dp[i][j] = max(dp[i-1][j], dp[i][j-1])
-    
-    lcs_length = dp[m][n]
-    return lcs_length / max(m, n) if max(m, n) > 0 else 0
+from ping_store import load_fishing_routes
+from route_features import ROUTE_STAT_COLUMNS, RouteTable, vessel_route_stats
+from route_similarity import (PROTECTED_AREAS, RouteLSHIndex, cached_pair_values, cached_pairs,
+                              calculate_protected_similarity, candidate_recall, encode_sequence_features,
+                              get_location_sequence_features, load_similarity_cache, protected_similarity_bounds,
+                              protected_similarity_matrix, protected_similarity_pairs, route_hash,
+                              save_similarity_cache)
 
-def calculate_protected_similarity(features1, features2):
-    """Calculate similarity of protected area visit patterns"""
-    similarity = 0
-    
-    # Protected area visit sequence similarity
-    seq_similarity = calculate_sequence_similarity(
-        features1['protected_visits'],
-        features2['protected_visits']
-    )
-    similarity += seq_similarity * 0.3
-    
-    # Similarity of sequences before and after protected areas
-    for area in protected_areas:
-        # Similarity of sequences before protected area
-        before1 = features1['before_protected'][area]
-        before2 = features2['before_protected'][area]
-        if before1 and before2:
-            before_similarity = calculate_sequence_similarity(before1, before2)
-            similarity += before_similarity * 0.2
-        
-        # Similarity of sequences after protected area
-        after1 = features1['after_protected'][area]
-        after2 = features2['after_protected'][area]
-        if after1 and after2:
-            after_similarity = calculate_sequence_similarity(after1, after2)
-            similarity += after_similarity * 0.2
-    
-    # Similarity of transitions between protected areas
-    transitions1 = set(features1['protected_transitions'].keys())
-    transitions2 = set(features2['protected_transitions'].keys())
-    transition_similarity = len(transitions1 & transitions2) / max(len(transitions1 | transitions2), 1)
-    similarity += transition_similarity * 0.3
-    
-    return similarity
+CHECKPOINT_DIR = 'similarity_checkpoint'
+CACHE_DIR = 'similarity_cache'
 
-# Process data
-vessel_features = []
-sequence_features = {}
+# Numeric features for the basic (cosine) similarity
+NUMERIC_FEATURES = ROUTE_STAT_COLUMNS
 
-for vessel in data['fishing_vessels']:
-    vessel_id = vessel['vessel_id']
-    company = vessel['company']
-    
-    # Extract basic features
-    locations = set()
-    dwell_times = []
-    times = []
-    
-    for point in vessel['route']:
-        locations.add(point['location'])
-        dwell_times.append(point['dwell'])
-        time_parts = point['time'].split('T')[1].split('.')[0].split(':')
-        hours = float(time_parts[0]) + float(time_parts[1])/60 + float(time_parts[2])/3600
-        times.append(hours)
-    
-    # Calculate statistical features
-    avg_dwell = np.mean(dwell_times) if dwell_times else 0
-    std_dwell = np.std(dwell_times) if dwell_times else 0
-    max_dwell = max(dwell_times) if dwell_times else 0
-    min_dwell = min(dwell_times) if dwell_times else 0
-    
-    avg_time = np.mean(times) if times else 0
-    std_time = np.std(times) if times else 0
-    
-    # Calculate location sequence features
-    sequence_features[vessel_id] = get_location_sequence_features(vessel['route'])
-    
-    vessel_features.append({
-        'vessel_id': vessel_id,
-        'company': company,
-        'num_locations': len(locations),
-        'avg_dwell': avg_dwell,
-        'std_dwell': std_dwell,
-        'max_dwell': max_dwell,
-        'min_dwell': min_dwell,
-        'avg_time': avg_time,
-        'std_time': std_time
+
+def build_vessel_features(data, feature_cache=None):
+    """
+    Basic per-vessel stats (DataFrame, with each route's hash) plus sequence
+    features by name and as location codes.
+
+    The stats are computed for all routes at once on a RouteTable.
+    `feature_cache` maps route hashes to sequence features; routes found
+    there are not recomputed, new ones are added to it.
+    """
+    if feature_cache is None:
+        feature_cache = {}
+
+    # Basic features of every route in one pass over the flat route table
+    table = RouteTable.from_routes(data['fishing_vessels'])
+    stats = vessel_route_stats(table).reset_index(drop=True)
+
+    # Create location index mapping (table locations are sorted)
+    location_to_idx = {loc: idx for idx, loc in enumerate(table.locations)}
+
+    # Process data
+    sequence_features = {}
+    sequence_codes = {}  # same features with locations as location_to_idx codes
+    route_hashes = []
+
+    for vessel in data['fishing_vessels']:
+        vessel_id = vessel['vessel_id']
+        key = route_hash(vessel['route'])
+        if key not in feature_cache:
+            # Calculate location sequence features
+            feature_cache[key] = get_location_sequence_features(vessel['route'])
+        sequence_features[vessel_id] = feature_cache[key]
+        sequence_codes[vessel_id] = encode_sequence_features(sequence_features[vessel_id], location_to_idx)
+        route_hashes.append(key)
+
+    # Convert to DataFrame
+    df = pd.concat([pd.DataFrame({'vessel_id': [vessel['vessel_id'] for vessel in data['fishing_vessels']],
+                                  'company': [vessel['company'] for vessel in data['fishing_vessels']]}),
+                    stats], axis=1).assign(route_hash=route_hashes)
+
+    return df, sequence_features, sequence_codes
+
+
+def compute_similarity_matrices(df, sequence_codes, workers=1, checkpoint_dir=None, pair_cache=None):
+    """
+    Basic (cosine), sequence and combined n x n similarity matrices.
+
+    `pair_cache` is (route hashes, sequence similarity matrix) of an
+    earlier run; pairs of routes found there are reused, so only rows and
+    columns of new or changed routes are computed.
+    """
+    # Select numeric features for similarity calculation
+    X = df[NUMERIC_FEATURES]
+
+    # Standardize features
+    scaler = StandardScaler()
+    X_scaled = scaler.fit_transform(X)
+
+    # Calculate basic feature similarity
+    basic_similarity_matrix = cosine_similarity(X_scaled)
+
+    # Calculate sequence feature similarity
+    known = None
+    if pair_cache is not None:
+        known = cached_pairs(df['route_hash'].tolist(), *pair_cache)
+    sequence_similarity_matrix = protected_similarity_matrix(
+        [sequence_codes[vessel_id] for vessel_id in df['vessel_id']],
+        workers=workers, checkpoint_dir=checkpoint_dir, known=known)
+
+    # Combine both similarities
+    combined_similarity_matrix = 0.5 * basic_similarity_matrix + 0.5 * sequence_similarity_matrix
+
+    return basic_similarity_matrix, sequence_similarity_matrix, combined_similarity_matrix
+
+
+def compute_lsh_similarity(df, sequence_codes, lsh_index, workers=1, pair_cache=None):
+    """
+    Sequence similarity of the LSH candidate pairs (and every vessel with
+    itself) only, as a sparse symmetric matrix that is 0 for all other
+    pairs. Candidate pairs come straight from the index buckets; pairs
+    found in `pair_cache` (see compute_similarity_matrices) are reused.
+    """
+    n = len(df)
+    left, right = lsh_index.candidate_pairs()
+    left, right = np.r_[left, np.arange(n)], np.r_[right, np.arange(n)]
+    if pair_cache is None:
+        values = np.full(len(left), np.nan)
+    else:
+        values = cached_pair_values(df['route_hash'].tolist(), *pair_cache, left, right)
+    missing = np.isnan(values)
+    print(f"Sequence similarity of {len(left) - n:,} candidate pairs "
+          f"({(len(left) - n) / max(n * (n - 1) // 2, 1):.1%} of all pairs; {int(missing.sum()):,} similarities "
+          f"to compute)")
+    values[missing] = protected_similarity_pairs([sequence_codes[vessel_id] for vessel_id in df['vessel_id']],
+                                                 left[missing], right[missing], workers=workers)
+    upper = sparse.csr_matrix((values, (left, right)), shape=(n, n))
+    return upper + sparse.triu(upper, 1).T.tocsr()
+
+
+def basic_similarity_row(df, target_idx):
+    """Basic (cosine) similarity of one vessel to every vessel"""
+    X_scaled = StandardScaler().fit_transform(df[NUMERIC_FEATURES])
+    return cosine_similarity(X_scaled[[target_idx]], X_scaled)[0]
+
+
+def query_similar_vessels(df, sequence_codes, targets, top_k=None, lsh_index=None):
+    """
+    Similarity of every vessel to each target, computing only the target
+    rows of the combined matrix.
+
+    With `top_k`, only the k most similar vessels are returned and exact
+    sequence similarity is skipped for vessels whose upper bound (from
+    protected_similarity_bounds) cannot beat the current k-th best. With
+    an `lsh_index`, only the target's LSH candidates are considered.
+    Returns {target: DataFrame like the report table, most similar first}.
+    """
+    X_scaled = StandardScaler().fit_transform(df[NUMERIC_FEATURES])
+    vessel_ids = df['vessel_id'].tolist()
+    position = {vessel_id: i for i, vessel_id in enumerate(vessel_ids)}
+    results = {}
+    for target in targets:
+        if target not in position:
+            raise KeyError(f"unknown vessel {target!r}")
+        target_codes = sequence_codes[target]
+        basic = cosine_similarity(X_scaled[[position[target]]], X_scaled)[0]
+        sequence = np.full(len(df), np.nan)
+
+        pool = np.arange(len(df))
+        if lsh_index is not None:
+            pool = np.r_[position[target], lsh_index.candidates(position[target])]
+        prune = top_k is not None and top_k < len(pool)
+        if not prune:
+            candidates = pool
+        else:
+            bounds = np.array([protected_similarity_bounds(target_codes, sequence_codes[vessel_ids[i]])
+                               for i in pool])
+            lower, upper = np.full(len(df), -np.inf), np.full(len(df), -np.inf)
+            lower[pool] = 0.5 * basic[pool] + 0.5 * bounds[:, 0]
+            upper[pool] = 0.5 * basic[pool] + 0.5 * bounds[:, 1]
+            # Anything below the k-th best lower bound can never make the top k
+            threshold = np.sort(lower)[-top_k]
+            candidates = [i for i in np.argsort(-upper, kind='stable') if upper[i] >= threshold]
+
+        best = []  # exact combined similarities seen so far
+        for i in candidates:
+            if prune and len(best) >= top_k and upper[i] < best[top_k - 1]:
+                break  # candidates come in decreasing upper bound order
+            sequence[i] = calculate_protected_similarity(target_codes, sequence_codes[vessel_ids[i]])
+            if prune:
+                best = sorted(best + [0.5 * basic[i] + 0.5 * sequence[i]], reverse=True)[:top_k]
+
+        computed = ~np.isnan(sequence)
+        similarity_df = pd.DataFrame({
+            'vessel_id': df['vessel_id'][computed],
+            'company': df['company'][computed],
+            'similarity': (0.5 * basic + 0.5 * sequence)[computed],
+            'basic_similarity': basic[computed],
+            'sequence_similarity': sequence[computed]
+        }).sort_values('similarity', ascending=False)
+        results[target] = similarity_df if top_k is None else similarity_df.head(top_k)
+    return results
+
+
+def write_similarity_report(df, sequence_features, basic_similarity, sequence_similarity, target_vessel):
+    # Target vessel's rows of the basic and sequence similarity
+    similarities = 0.5 * basic_similarity + 0.5 * sequence_similarity
+
+    # Create similarity DataFrame
+    similarity_df = pd.DataFrame({
+        'vessel_id': df['vessel_id'],
+        'company': df['company'],
+        'similarity': similarities,
+        'basic_similarity': basic_similarity,
+        'sequence_similarity': sequence_similarity
     })
 
-# Convert to DataFrame
-df = pd.DataFrame(vessel_features)
-
-# Select numeric features for similarity calculation
-numeric_features = ['num_locations', 'avg_dwell', 'std_dwell', 'max_dwell', 'min_dwell', 'avg_time', 'std_time']
-X = df[numeric_features]
-
-# Standardize features
-scaler = StandardScaler()
-X_scaled = scaler.fit_transform(X)
-
-# Calculate basic feature similarity
-basic_similarity_matrix = cosine_similarity(X_scaled)
-
-# Calculate sequence feature similarity
-sequence_similarity_matrix = np.zeros((len(df), len(df)))
-for i, vessel1 in enumerate(df['vessel_id']):
-    for j, vessel2 in enumerate(df['vessel_id']):
-        if i <= j:
-            similarity = calculate_protected_similarity(
-                sequence_features[vessel1],
-                sequence_features[vessel2]
-            )
-            sequence_similarity_matrix[i, j] = similarity
-            sequence_similarity_matrix[j, i] = similarity
-
-# Combine both similarities
-combined_similarity_matrix = 0.5 * basic_similarity_matrix + 0.5 * sequence_similarity_matrix
-
-# Get target vessel similarity
-target_vessel = 'snappersnatcher7be'
-target_idx = df[df['vessel_id'] == target_vessel].index[0]
-similarities = combined_similarity_matrix[target_idx]
-
-# Create similarity DataFrame
-similarity_df = pd.DataFrame({
-    'vessel_id': df['vessel_id'],
-    'company': df['company'],
-    'similarity': similarities,
-    'basic_similarity': basic_similarity_matrix[target_idx],
-    'sequence_similarity': sequence_similarity_matrix[target_idx]
-})
-
-# Sort by similarity
-similarity_df = similarity_df.sort_values('similarity', ascending=False)
-
-# Create HTML content
-html_content = f"""
+    # Sort by similarity
+    similarity_df = similarity_df.sort_values('similarity', ascending=False)
+
+    # Create HTML content
+    html_content = f"""
 <!DOCTYPE html>
 <html>
 <head>
@@ -301,21 +296,21 @@ html_content = f"""
                 </tr>
 """
 
-# Add table rows
-for _, row in similarity_df.iterrows():
-    row_class = "target-vessel" if row['vessel_id'] == target_vessel else ""
+    # Add table rows
+    for _, row in similarity_df.iterrows():
+        row_class = "target-vessel" if row['vessel_id'] == target_vessel else ""
     
-    # Get protected area visit pattern description
-    vessel_features = sequence_features[row['vessel_id']]
-    protected_pattern = []
-    for area in protected_areas:
-        if area in vessel_features['protected_visits']:
-            before = vessel_features['before_protected'][area]
-            after = vessel_features['after_protected'][area]
-            pattern = f"{area}: Before visit={before}, After visit={after}"
-            protected_pattern.append(pattern)
+        # Get protected area visit pattern description
+        vessel_features = sequence_features[row['vessel_id']]
+        protected_pattern = []
+        for area in PROTECTED_AREAS:
+            if area in vessel_features['protected_visits']:
+                before = vessel_features['before_protected'][area]
+                after = vessel_features['after_protected'][area]
+                pattern = f"{area}: Before visit={before}, After visit={after}"
+                protected_pattern.append(pattern)
     
-    html_content += f"""
+        html_content += f"""
                 <tr class="{row_class}">
                     <td>{row['vessel_id']}</td>
                     <td>{row['company']}</td>
@@ -326,8 +321,8 @@ for _, row in similarity_df.iterrows():
                 </tr>
 """
 
-# Complete HTML content
-html_content += """
+    # Complete HTML content
+    html_content += """
             </table>
         </div>
     </div>
@@ -335,10 +330,76 @@ html_content += """
 </html>
 """
 
-# Save HTML file
-with open('vessel_similarity.html', 'w') as f:
-    f.write(html_content)
+    # Save HTML file
+    with open('vessel_similarity.html', 'w') as f:
+        f.write(html_content)
+
+    # Print similarity analysis for all vessels
+    print("\nSimilarity analysis for all vessels:")
+    print(similarity_df.to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Rank fishing vessels by similarity to a target vessel')
+    parser.add_argument('--target', default='snappersnatcher7be', help='target vessel id')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='processes for the all-pairs sequence similarity (default: all cores)')
+    parser.add_argument('--checkpoint-dir', default=CHECKPOINT_DIR,
+                        help='where finished similarity tiles are kept so an interrupted run resumes')
+    parser.add_argument('--cache-dir', default=CACHE_DIR,
+                        help='per-route features and pair similarities reused across runs')
+    parser.add_argument('--no-cache', action='store_true', help='ignore and do not update the cache')
+    parser.add_argument('--query', nargs='+', metavar='VESSEL_ID',
+                        help='only print the vessels most similar to these vessels (no full matrix, no HTML)')
+    parser.add_argument('--top-k', type=int, help='with --query, keep only the k most similar vessels')
+    parser.add_argument('--lsh', action='store_true',
+                        help='only compare vessels that the MinHash/LSH index finds as candidates (approximate)')
+    parser.add_argument('--lsh-recall', action='store_true',
+                        help='compute the exact matrix and print the recall of the LSH candidates against it')
+    args = parser.parse_args()
+    if args.top_k is not None and args.top_k < 1:
+        parser.error('--top-k must be at least 1')
+
+    # Read fishing vessel routes from the columnar ping store
+    data = load_fishing_routes()
+    feature_cache, pair_cache = ({}, None) if args.no_cache else load_similarity_cache(args.cache_dir)
+    df, sequence_features, sequence_codes = build_vessel_features(data, feature_cache)
+    lsh_index = None
+    if args.lsh or args.lsh_recall:
+        start_time = time.time()
+        lsh_index = RouteLSHIndex([sequence_codes[vessel_id] for vessel_id in df['vessel_id']])
+        print(f"Built LSH index over {len(df)} vessels in {time.time() - start_time:.2f}s")
 
-# Print similarity analysis for all vessels
-print("\nSimilarity analysis for all vessels:")
-print(similarity_df.to_string(index=False)) 
\ No newline at end of file
+    if args.lsh_recall:
+        start_time = time.time()
+        matrices = compute_similarity_matrices(df, sequence_codes, args.workers, args.checkpoint_dir, pair_cache)
+        print(f"Exact sequence similarity matrix in {time.time() - start_time:.2f}s")
+        if not args.no_cache:
+            save_similarity_cache(args.cache_dir, feature_cache, df['route_hash'].tolist(), matrices[1])
+        for k in (1, 5, 10, 20):
+            recall, candidate_share = candidate_recall(lsh_index, matrices[1], k)
+            print(f"LSH recall@{k}: {recall:.3f}  (candidates: {candidate_share:.1%} of all pairs)")
+    elif args.query:
+        unknown = [v for v in args.query if v not in sequence_codes]
+        if unknown:
+            parser.error(f"unknown vessel(s): {', '.join(unknown)}")
+        start_time = time.time()
+        results = query_similar_vessels(df, sequence_codes, args.query, args.top_k, lsh_index)
+        for target, similarity_df in results.items():
+            print(f"\nVessels most similar to {target}:")
+            print(similarity_df.to_string(index=False))
+        print(f"\nQueried {len(args.query)} vessel(s) in {(time.time() - start_time) * 1000:.1f} ms")
+    else:
+        target_idx = df[df['vessel_id'] == args.target].index[0]
+        if args.lsh:
+            # Approximate: sparse candidate pairs only, and no pairs are cached
+            sequence = compute_lsh_similarity(df, sequence_codes, lsh_index, args.workers, pair_cache)
+            rows = basic_similarity_row(df, target_idx), sequence.getrow(target_idx).toarray()[0]
+        else:
+            matrices = compute_similarity_matrices(df, sequence_codes, args.workers, args.checkpoint_dir,
+                                                   pair_cache)
+            rows = matrices[0][target_idx], matrices[1][target_idx]
+        if not args.no_cache:
+            save_similarity_cache(args.cache_dir, feature_cache, df['route_hash'].tolist(),
+                                  None if args.lsh else matrices[1])
+        write_similarity_report(df, sequence_features, *rows, args.target)
@@ -2,8 +2,11 @@ import folium
 import json
 from datetime import datetime
 from folium.plugins import MarkerCluster
+import os
 import random
 
+from route_store import CompactRoutes
+
 def get_random_color():
     """Generate random color"""
     return '#{:06x}'.format(random.randint(0, 0xFFFFFF))
@@ -284,8 +287,12 @@ def visualize_vessel_routes():
         
         # Read fishing vessel route data
         print("Reading fishing vessel route data...")
-        with open('./fishing_vessel_routes.json', 'r', encoding='utf-8') as f:
-            vessel_data = json.load(f)
+        if os.path.exists('./fishing_vessel_routes.npz'):
+            # Compact route file (extract_vessel_routes.py --format npz)
+            vessel_data = CompactRoutes('./fishing_vessel_routes.npz').to_routes()
+        else:
+            with open('./fishing_vessel_routes.json', 'r', encoding='utf-8') as f:
+                vessel_data = json.load(f)
         print(f"Successfully read vessel data, found {len(vessel_data['fishing_vessels'])} vessels")
         
         # Get location coordinate mapping